@@ -1,62 +1,178 @@
-import google.generativeai as genai
-import time
 import json
+import logging
+import re
+from io import BytesIO
 from PIL import Image
 import streamlit as st
 import hashlib
-from datetime import datetime, timedelta
+import threading
+from concurrent.futures import CancelledError
+from workers import SingleFlight
+from jobs import current_job
+from gemini_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, estimate_tokens, get_scheduler
+from model_router import get_router
+from metrics import REGISTRY, Timer, cache_lookup, cache_miss, cache_result, record_backoff, record_request, record_retry
+from profile_store import get_profile_store
+from prompts import BATCH_BIO_CHARS, TokenBudgetExceeded, compact_biography, get_token_ledger, usage_tokens
+from semantic_cache import get_semantic_cache
+from vision_index import dhash, downscale_for_model, get_vision_index, load_image
+
+log = logging.getLogger(__name__)
 
 # --- CẤU HÌNH MODEL ---
-MODEL_NAME = "gemini-2.5-flash"
-
-# --- RATE LIMITER ---
-if 'last_api_call' not in st.session_state:
-    st.session_state.last_api_call = None
-
-@st.cache_resource
-def get_model():
-    return genai.GenerativeModel(MODEL_NAME)
-
-def enforce_minimum_delay(min_seconds=4):
-    """BẮT BUỘC delay 4s giữa mỗi API call"""
-    if st.session_state.last_api_call:
-        elapsed = (datetime.now() - st.session_state.last_api_call).total_seconds()
-        if elapsed < min_seconds:
-            wait_time = min_seconds - elapsed
-            with st.spinner(f"⏳ Rate limiting... {wait_time:.1f}s"):
-                time.sleep(wait_time)
-    st.session_state.last_api_call = datetime.now()
-
-def safe_api_call(func, *args, **kwargs):
-    """Retry với exponential backoff"""
+# Model cho từng loại việc do model_router chọn (tier theo latency / lỗi gần đây)
+
+_usage = threading.local()  # token thực tế của lời gọi safe_api_call đang chạy trên thread này
+
+def _estimate_contents(contents):
+    """Ước lượng token cho contents của generate_content (~258 token mỗi ảnh)"""
+    parts = contents if isinstance(contents, list) else [contents]
+    text = "".join(p for p in parts if isinstance(p, str))
+    return estimate_tokens(text) + 258 * sum(1 for p in parts if not isinstance(p, str))
+
+def generate(task, contents, **kwargs):
+    """
+    model.generate_content trên model router chọn cho task (có hedge khi chậm).
+    Ghi token của mọi response (cả bản hedge thua) vào sổ token theo task;
+    stream thì usage chỉ có sau khi đọc hết - caller tự ghi.
+    Bản hedge được admit ở scheduler theo ước lượng token của chính contents này.
+    """
+    stream = kwargs.get("stream", False)
+
+    def _call(model):
+        response = model.generate_content(contents, **kwargs)
+        if not stream:
+            get_token_ledger().record_response(task, response)
+        return response
+
+    response = get_router().call(task, _call, est_tokens=_estimate_contents(contents))
+    if not stream:
+        input_tokens, output_tokens = usage_tokens(response)
+        _usage.tokens = getattr(_usage, "tokens", 0) + input_tokens + output_tokens
+    return response
+
+def wait_for_quota(priority=PRIORITY_INTERACTIVE, est_tokens=1000):
+    """Xếp hàng ở scheduler chung của process, hiện thời gian chờ ước lượng"""
+    scheduler = get_scheduler()
+    eta = scheduler.estimate_wait(priority, est_tokens)
+    job = current_job()
+    if job is not None:
+        # Trong job: báo ETA cho UI đang poll, huỷ job thì rời hàng đợi ngay
+        job.report(f"⏳ Waiting for Gemini quota... ~{eta:.0f}s" if eta >= 0.5 else "🤖 Asking Gemini...", eta=eta)
+        admission = scheduler.admit(priority, est_tokens, abort=job.cancel_event)
+        job.report("🤖 Asking Gemini...")
+        return admission
+    if eta < 0.5 or priority != PRIORITY_INTERACTIVE:
+        return scheduler.admit(priority, est_tokens)
+    with st.spinner(f"⏳ Waiting for Gemini quota... ~{eta:.0f}s"):
+        return scheduler.admit(priority, est_tokens)
+
+def _error_status(error_msg):
+    """Nhãn status cho metrics từ message lỗi của SDK"""
+    # Lỗi quota trước: message kiểu "... quota. limit: 500" không được thành "500"
+    if "ResourceExhausted" in error_msg or "quota" in error_msg.casefold():
+        return "429"
+    match = re.search(r"\b(429|503|500)\b", error_msg)
+    return match.group(1) if match else "error"
+
+def _notify(level, message, priority):
+    """Báo lỗi / chờ: qua job đang chạy (worker thread), hoặc lên trang nếu là call interactive"""
+    job = current_job()
+    if job is not None:
+        job.report(message, level=level)
+    elif priority == PRIORITY_INTERACTIVE:
+        getattr(st, level)(message)
+
+def safe_api_call(func, *args, priority=PRIORITY_INTERACTIVE, est_tokens=1000, feature="generate", **kwargs):
+    """Retry với exponential backoff (backoff là pause của scheduler, chờ ở lần admit sau)"""
     backoff_times = [5, 10, 20, 40, 60]
+    try:
+        get_token_ledger().check(feature, est_tokens)
+    except TokenBudgetExceeded as e:
+        log.warning("%s", e)
+        _notify("error", f"🚫 {e}. Please try again later.", priority)
+        return None
     
     for attempt, wait_time in enumerate(backoff_times):
+        timer = Timer()
         try:
-            enforce_minimum_delay(4)
-            result = func(*args, **kwargs)
+            admission = wait_for_quota(priority, est_tokens)
+            _usage.tokens = 0
+            with timer:
+                result = func(*args, **kwargs)
+            # Quota của scheduler tính theo token thật thay vì ước lượng
+            admission.settle(_usage.tokens)
+            record_request("gemini", feature, "ok", timer.seconds)
             return result
+        except CancelledError:
+            # Job bị huỷ lúc đang chờ quota
+            raise
         except Exception as e:
             error_msg = str(e)
-            if any(x in error_msg for x in ["429", "ResourceExhausted", "503", "quota"]):
+            status = _error_status(error_msg)
+            record_request("gemini", feature, status, getattr(timer, "seconds", 0.0))
+            # Việc nền (prefetch) không có trang để báo lỗi → log ra server
+            log.warning("%s attempt %d: %s", feature, attempt + 1, error_msg[:200])
+            if status in ("429", "503"):
                 if attempt < len(backoff_times) - 1:
-                    st.warning(f"⏳ Server busy. Waiting {wait_time}s... ({attempt+1}/{len(backoff_times)})")
-                    time.sleep(wait_time)
+                    # Báo scheduler để mọi session cùng lùi lại, không chỉ session này
+                    get_scheduler().pause(wait_time)
+                    record_retry("gemini", feature, status)
+                    record_backoff("gemini", wait_time)
+                    _notify("warning", f"⏳ Server busy. Waiting {wait_time}s... ({attempt+1}/{len(backoff_times)})", priority)
                     continue
                 else:
-                    st.error("🚫 Server quá tải. Vui lòng đợi 2-3 phút rồi thử lại.")
+                    _notify("error", "🚫 Server quá tải. Vui lòng đợi 2-3 phút rồi thử lại.", priority)
                     return None
             else:
-                st.error(f"❌ Lỗi: {error_msg[:150]}")
+                _notify("error", f"❌ Lỗi: {error_msg[:150]}", priority)
                 return None
     return None
 
+# --- SINGLE-FLIGHT ---
+# st.cache_data không chặn được 2 session cùng miss một lúc → gộp theo prompt đã chuẩn hoá
+_gemini_flight = SingleFlight(ttl=60)
+
+def normalize_prompt(prompt):
+    return " ".join(prompt.split()).casefold()
+
+def coalesced_api_call(key, func, est_tokens=1000, priority=PRIORITY_INTERACTIVE, feature="generate"):
+    """safe_api_call, nhưng các request trùng key đồng thời chỉ gọi Gemini một lần"""
+    return _gemini_flight.do(key, lambda: safe_api_call(func, priority=priority, est_tokens=est_tokens, feature=feature))
+
+def get_singleflight_stats():
+    """Số lần hit / miss / coalesced của lớp single-flight"""
+    return _gemini_flight.get_stats()
+
+def _gemini_samples():
+    samples = [("itook_singleflight", {"result": k}, v) for k, v in get_singleflight_stats().items()]
+    samples.append(("itook_gemini_queue_length", {}, get_scheduler().queue_length()))
+    return samples
+
+REGISTRY.register_collector(_gemini_samples)
+
 # --- CÁC HÀM API với @st.cache_data ---
 
-@st.cache_data(ttl=7200, show_spinner=False)
+class GeminiUnavailable(Exception):
+    """Gemini lỗi / hết ngân sách token: raise trong hàm @st.cache_data để kết quả rỗng không bị cache"""
+
 def get_ai_recommendations(age, interests, mood, style, content_type):
-    """AI Recommendations - Cache 2 giờ"""
-    model = get_model()
+    """AI Recommendations - Cache 2 giờ (exact), semantic cache cho request gần giống"""
+    cache_lookup("recommendations")
+    try:
+        return _get_ai_recommendations(age, interests, mood, style, content_type)
+    except GeminiUnavailable:
+        return []
+
+@st.cache_data(ttl=7200, show_spinner=False)
+def _get_ai_recommendations(age, interests, mood, style, content_type):
+    cache_miss("recommendations")
+    semantic = get_semantic_cache()
+    cached = semantic.lookup(age, interests, mood, style, content_type)
+    cache_result("semantic", bool(cached))
+    if cached:
+        return cached
+
     prompt = f"""
 Act as an expert OTAKU. Recommend 5 {content_type} series.
 User Info: {age} years old.
@@ -69,18 +185,20 @@ Format: [{{"title": "Name", "genre": "Genre", "reason": "Why this fits"}}]
 """
     
     def _call():
-        response = model.generate_content(prompt)
+        response = generate("recommend", prompt)
         text = response.text.strip().replace("```json", "").replace("```", "").strip()
         return json.loads(text)
     
-    result = safe_api_call(_call)
-    return result if result else []
+    result = coalesced_api_call(normalize_prompt(prompt), _call, estimate_tokens(prompt), feature="recommend")
+    if not result:
+        raise GeminiUnavailable("recommend")
+    semantic.store(age, interests, mood, style, content_type, result)
+    return result
 
 @st.cache_data(ttl=86400, show_spinner=False)
 def ai_vision_detect_cached(image_bytes):
-    """Vision Detection - Cache 24 giờ theo image bytes"""
-    model = get_model()
-    from io import BytesIO
+    """Vision Detection - Cache 24 giờ theo bytes của ảnh ĐÃ thu nhỏ"""
+    cache_miss("vision")
     img = Image.open(BytesIO(image_bytes))
     
     prompt = """Look at this anime character image.
@@ -89,64 +207,169 @@ If cannot identify, return exactly: "Unknown"
 No explanation, just the name."""
     
     def _call():
-        response = model.generate_content([prompt, img])
+        response = generate("vision", [prompt, img])
         return response.text.strip()
     
-    result = safe_api_call(_call)
-    return result if result else "Unknown"
+    key = normalize_prompt(prompt) + ":" + hashlib.sha256(image_bytes).hexdigest()
+    # Ảnh tính ~258 token ở độ phân giải chuẩn
+    result = coalesced_api_call(key, _call, estimate_tokens(prompt, expected_output=300), feature="vision")
+    if not result:
+        raise GeminiUnavailable("vision")
+    return result
 
 def ai_vision_detect(image_file):
-    """Wrapper cho vision detection"""
+    """Wrapper cho vision detection: tra dHash trước, chỉ gửi ảnh đã thu nhỏ lên Gemini"""
     image_file.seek(0)
     image_bytes = image_file.read()
     image_file.seek(0)
-    return ai_vision_detect_cached(image_bytes)
 
-@st.cache_data(ttl=86400, show_spinner=False)
-def generate_ai_profile_text(char_id, char_name, char_about):
-    """
-    Generate AI Profile - Cache 24 giờ theo char_id
-    ĐÂY LÀ HÀM CHÍNH ĐỂ CACHE
-    """
-    model = get_model()
-    
-    if char_about and len(char_about) > 2000:
-        char_about = char_about[:2000] + "..."
+    img = load_image(image_bytes)
+    image_hash = dhash(img)
+    index = get_vision_index()
+    name = index.lookup(image_hash)
+    cache_result("vision_hash", bool(name))
+    if name:
+        return name
 
-    prompt = f"""You are an expert Anime Otaku. Write an engaging character profile in ENGLISH.
-
-Character Name: {char_name}
-Biography: {char_about}
+    cache_lookup("vision")
+    try:
+        name = ai_vision_detect_cached(downscale_for_model(img))
+    except GeminiUnavailable:
+        return "Unknown"
+    if name != "Unknown":
+        index.add(image_hash, name)
+    return name
 
-Requirements:
-- Catchy title with emojis (🌟🔥✨)
+# --- AI PROFILE ---
+PROFILE_ERROR = "⚠️ Could not generate profile. Please try again later."
+PROFILE_REQUIREMENTS = """- Catchy title with emojis (🌟🔥✨)
 - Fun, enthusiastic tone
 - Analyze personality and powers
 - Keep under 200 words
 - Make it engaging!"""
+
+def build_profile_prompt(char_name, char_about):
+    char_about = compact_biography(char_about, char_name) or "N/A"
+
+    return f"""You are an expert Anime Otaku. Write an engaging character profile in ENGLISH.
+
+Character Name: {char_name}
+Biography: {char_about}
+
+Requirements:
+{PROFILE_REQUIREMENTS}"""
+
+def build_batch_profile_prompt(chars, about_limit=BATCH_BIO_CHARS):
+    """Nhiều nhân vật trong một prompt (batch job); trả lời là JSON {id: profile}"""
+    blocks = []
+    for c in chars:
+        about = compact_biography(c.get('about'), c.get('name'), about_limit) or 'N/A'
+        blocks.append(f"ID {c['mal_id']} - {c.get('name', 'N/A')}\nBiography: {about}")
+    sections = "\n\n".join(blocks)
+    return f"""You are an expert Anime Otaku. Write an engaging character profile in ENGLISH for EACH character below.
+
+{sections}
+
+Requirements for every profile:
+{PROFILE_REQUIREMENTS}
+
+IMPORTANT: Return ONLY a valid JSON object mapping each ID to its profile text. No markdown, no backticks.
+Format: {{"<ID>": "<profile>"}}"""
+
+def generate_ai_profile_text(char_id, char_name, char_about):
+    """Generate AI Profile (non-stream) - lưu vào profile store theo char_id"""
+    cached = get_profile_store().get(char_id)
+    cache_result("profile", bool(cached))
+    if cached:
+        return cached
+
+    prompt = build_profile_prompt(char_name, char_about)
     
     def _call():
-        response = model.generate_content(prompt)
+        response = generate("profile", prompt)
         return response.text.strip()
     
-    result = safe_api_call(_call)
-    return result if result else "⚠️ Could not generate profile. Please try again later."
+    result = coalesced_api_call(normalize_prompt(prompt), _call, estimate_tokens(prompt), feature="profile")
+    if not result:
+        return PROFILE_ERROR
+    get_profile_store().put(char_id, result, name=char_name)
+    return result
+
+def prefetch_ai_profile(info):
+    """Viết sẵn profile ở mức ưu tiên background (dự đoán người dùng sắp xem)"""
+    char_id = info.get('mal_id')
+    if not char_id or get_profile_store().get(char_id):
+        return
+    char_name = info.get('name', 'N/A')
+    prompt = build_profile_prompt(char_name, info.get('about', 'N/A'))
+
+    def _call():
+        response = generate("profile_prefetch", prompt)
+        return response.text.strip()
+
+    # Key riêng: dùng chung key với stream interactive thì user mở đúng nhân vật này
+    # sẽ phải chờ lời gọi ưu tiên background (priority inversion)
+    result = coalesced_api_call("prefetch:" + normalize_prompt(prompt), _call, estimate_tokens(prompt),
+                                PRIORITY_BACKGROUND, feature="profile_prefetch")
+    if result:
+        get_profile_store().put(char_id, result, name=char_name, source="prefetch")
 
 def generate_ai_stream(info):
     """
-    Wrapper cho stream - GỌI HÀM CACHED
-    Trả về list chunks để tương thích với code cũ
+    Stream profile từng chunk (generator of str) cho st.write_stream.
+    Có trong profile store → trả nguyên văn ngay; stream xong → ghi vào store.
     """
     char_id = info.get('mal_id')
     char_name = info.get('name', 'N/A')
     char_about = info.get('about', 'N/A')
-    
-    # GỌI HÀM CACHED - Nếu có cache thì return ngay lập tức
-    full_text = generate_ai_profile_text(char_id, char_name, char_about)
-    
-    # Fake stream để UX mượt
-    class TextChunk:
-        def __init__(self, text):
-            self.text = text
-    
-    return [TextChunk(full_text)]
+
+    # Profile đã có (batch job hoặc người khác đã generate) → không gọi API
+    cached = get_profile_store().get(char_id)
+    cache_result("profile", bool(cached))
+    if cached:
+        yield cached
+        return
+
+    prompt = build_profile_prompt(char_name, char_about)
+    key = normalize_prompt(prompt)
+    future, leader = _gemini_flight.claim(key)
+    if not leader:
+        # Session khác đang stream cùng nhân vật → chờ kết quả của nó
+        try:
+            yield future.result() or PROFILE_ERROR
+        except CancelledError:
+            yield generate_ai_profile_text(char_id, char_name, char_about)
+        return
+
+    full_text = ""
+    try:
+        response = safe_api_call(lambda: generate("profile_stream", prompt, stream=True),
+                                 est_tokens=estimate_tokens(prompt), feature="profile_stream")
+        if response is None:
+            _gemini_flight.resolve(key, future, None)
+            yield PROFILE_ERROR
+            return
+        for chunk in response:
+            piece = chunk.text
+            full_text += piece
+            yield piece
+        # Stream đọc hết mới có usage_metadata
+        get_token_ledger().record_response("profile_stream", response)
+    except CancelledError:
+        # Job bị huỷ lúc đang chờ quota → follower tự gọi lại
+        _gemini_flight.resolve(key, future, cancelled=True)
+        raise
+    except Exception as e:
+        _gemini_flight.resolve(key, future, None)
+        record_request("gemini", "profile_stream", "error", 0.0)
+        log.warning("profile stream for %s interrupted: %s", char_id, e)
+        yield "\n\n⚠️ Stream interrupted. Please try again."
+        return
+    except BaseException:
+        # Streamlit rerun/stop giữa chừng → follower tự gọi lại
+        _gemini_flight.resolve(key, future, cancelled=True)
+        raise
+
+    full_text = full_text.strip()
+    _gemini_flight.resolve(key, future, full_text)
+    get_profile_store().put(char_id, full_text, name=char_name)
@@ -0,0 +1,96 @@
+import os
+import base64
+import streamlit as st
+from PIL import Image, features
+
+# --- ASSET PIPELINE ---
+# Background images in resources/ are resized and re-encoded once per process
+# into static/bg/, which Streamlit serves at app/static/bg/ (see
+# .streamlit/config.toml). Pages reference the URL instead of inlining base64.
+
+RESOURCES_DIR = os.path.join(os.getcwd(), "resources")
+STATIC_DIR = os.path.join(os.getcwd(), "static", "bg")
+STATIC_URL = "app/static/bg"
+
+MAX_SIZE = (1920, 1920)
+QUALITY = {"webp": 72, "avif": 55}
+SOURCE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+def _output_formats():
+    formats = ["webp"]
+    if features.check("avif"):
+        formats.append("avif")
+    return formats
+
+
+def _is_fresh(src, dst):
+    return os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src)
+
+
+def build_variant(filename):
+    """Build the compressed variants of one resource, return {format: file path}"""
+    src = os.path.join(RESOURCES_DIR, filename)
+    stem = os.path.splitext(filename)[0]
+    os.makedirs(STATIC_DIR, exist_ok=True)
+
+    variants = {}
+    img = None
+    for fmt in _output_formats():
+        dst = os.path.join(STATIC_DIR, f"{stem}.{fmt}")
+        if not _is_fresh(src, dst):
+            if img is None:
+                img = Image.open(src).convert("RGB")
+                img.thumbnail(MAX_SIZE, Image.LANCZOS)
+            img.save(dst, fmt.upper(), quality=QUALITY[fmt])
+        variants[fmt] = dst
+    return variants
+
+
+def build_all_assets():
+    """Build variants for every image in resources/ - dùng cho build step"""
+    manifest = {}
+    if not os.path.isdir(RESOURCES_DIR):
+        return manifest
+    for filename in sorted(os.listdir(RESOURCES_DIR)):
+        if not filename.lower().endswith(SOURCE_EXTS):
+            continue
+        try:
+            manifest[filename] = build_variant(filename)
+        except OSError:
+            continue
+    return manifest
+
+
+@st.cache_resource(show_spinner=False)
+def get_asset_manifest():
+    """Process-wide manifest, built once per server process"""
+    return build_all_assets()
+
+
+def static_serving_enabled():
+    return bool(st.get_option("server.enableStaticServing"))
+
+
+def get_background_urls(filename):
+    """Return {format: url} for a resource, or None if it does not exist"""
+    variants = get_asset_manifest().get(filename)
+    if not variants:
+        return None
+    return {fmt: f"{STATIC_URL}/{os.path.basename(path)}" for fmt, path in variants.items()}
+
+
+@st.cache_resource(show_spinner=False)
+def get_inline_background(filename):
+    """Fallback khi static serving tắt: base64 của bản WebP đã nén, cache theo process"""
+    variants = get_asset_manifest().get(filename)
+    if not variants:
+        return None
+    with open(variants["webp"], "rb") as f:
+        return base64.b64encode(f.read()).decode()
+
+
+if __name__ == "__main__":
+    for name, variants in build_all_assets().items():
+        sizes = ", ".join(f"{fmt}: {os.path.getsize(p) // 1024} KB" for fmt, p in variants.items())
+        print(f"{name} -> {sizes}")
@@ -0,0 +1,376 @@
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+# --- BENCHMARK / LOAD TEST OFFLINE ---
+# Chạy N session mô phỏng qua mọi trang của main.py bằng AppTest, với Jikan và
+# Gemini giả (latency, 429 cấu hình được) → không tốn quota thật.
+# Báo cáo p50/p95/p99 thời gian mỗi rerun, số lần gọi ra ngoài, bộ nhớ mỗi session;
+# kết quả lưu bench/results/<commit>.json để so sánh giữa các commit.
+# Mỗi session chạy trong một process riêng (AppTest không cô lập được session
+# giữa các thread). Cache trong bộ nhớ, scheduler và GEMINI_RPM/TPM vì vậy là
+# của từng process; cache trên đĩa (ITOOK_CACHE_DIR) và Jikan giả thì dùng chung.
+#   python bench/run.py --sessions 50 --concurrency 10
+#   python bench/run.py --gemini-429 0.05 --jikan-latency 0.4
+#   python bench/run.py --vision-images 8  # mỗi session nhận diện 8 ảnh song song
+#   python bench/run.py --gemini-model-latency gemini-2.5-flash=15  # tier chính chậm → hedge
+#   python bench/run.py --compare <commit hoặc file json>
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+MAIN = os.path.join(ROOT, "main.py")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+INTERESTS = [
+    "I like cats and cyberpunk", "cyberpunk, cats", "space pirates and big battles",
+    "cooking, romance and school life", "complex villains", "samurai history and swords",
+]
+CHARACTERS = ["naruto", "luffy", "levi", "light", "goku", "edward", "saitama", "spike"]
+STEPS = [
+    "home", "genre_open", "genre_search", "genre_more", "recommend_open", "recommend_submit",
+    "recommend_result", "wiki_open", "wiki_search", "wiki_profile", "wiki_profile_result",
+    "vision_upload", "vision_identify", "vision_result", "favorites_open",
+]
+POLL_INTERVAL = 0.5  # như job_progress(run_every="0.5s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test of main.py with stub Jikan and Gemini")
+    parser.add_argument("--sessions", type=int, default=20, help="number of simulated users")
+    parser.add_argument("--concurrency", type=int, default=5, help="sessions running at the same time")
+    parser.add_argument("--jikan-latency", type=float, default=0.15)
+    parser.add_argument("--jikan-429", type=float, default=0.0, help="probability of a 429 from Jikan")
+    parser.add_argument("--gemini-latency", type=float, default=0.8)
+    parser.add_argument("--gemini-model-latency", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="latency of one stub model (repeatable)")
+    parser.add_argument("--gemini-429", type=float, default=0.0, help="probability of a 429 from Gemini")
+    parser.add_argument("--gemini-rpm", type=int, default=1000, help="GEMINI_RPM seen by the app")
+    parser.add_argument("--gemini-tpm", type=int, default=10_000_000, help="GEMINI_TPM seen by the app")
+    parser.add_argument("--vision-images", type=int, default=3, help="images uploaded per session (0 = skip)")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds allowed per rerun")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (faster)")
+    parser.add_argument("--label", help="results file name (default: commit sha)")
+    parser.add_argument("--compare", help="baseline results: commit sha, label or path to json")
+    return parser.parse_args(argv)
+
+
+def prepare_environment(args, server):
+    """Env phải có trước khi main.py import các module của app"""
+    os.environ["JIKAN_BASE_URL"] = server.base_url
+    os.environ["ITOOK_CACHE_DIR"] = tempfile.mkdtemp(prefix="itook-bench-")
+    os.environ["ITOOK_METRICS_FILE"] = os.path.join(os.environ["ITOOK_CACHE_DIR"], "metrics.prom")
+    os.environ["GEMINI_RPM"] = str(args.gemini_rpm)
+    os.environ["GEMINI_TPM"] = str(args.gemini_tpm)
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+class SessionError(Exception):
+    pass
+
+
+class Session:
+    """Một user mô phỏng đi qua tất cả các trang"""
+
+    def __init__(self, index, timeout, vision_images=3):
+        from streamlit.testing.v1 import AppTest
+
+        self.index = index
+        self.rng = random.Random(index)
+        self.at = AppTest.from_file(MAIN, default_timeout=timeout)
+        self.at.secrets["GEMINI_API_KEY"] = "bench"
+        self.timeout = timeout
+        self.vision_images = vision_images
+        self.timings = []  # (step, seconds)
+
+    def _timed(self, step, action):
+        started = time.perf_counter()
+        action()
+        self.timings.append((step, time.perf_counter() - started))
+        if self.at.exception:
+            raise SessionError(f"{step}: {self.at.exception[0].value}")
+
+    def _goto(self, page):
+        self.at.session_state.current_page = page
+        self.at.run()
+
+    def _button(self, label):
+        matches = [b for b in self.at.button if label in b.label]
+        return matches[-1] if matches else None
+
+    def _click(self, label):
+        button = self._button(label)
+        if button is None:
+            raise SessionError(f"button {label!r} not found")
+        button.click().run()
+
+    def _until(self, done, timeout):
+        """Poll như fragment job_progress tới khi done() (việc AI chạy nền trong jobs)"""
+        deadline = time.monotonic() + timeout
+        while not done():
+            if time.monotonic() > deadline:
+                raise SessionError("timed out waiting for a background job")
+            time.sleep(POLL_INTERVAL)
+            self.at.run()
+
+    def _images(self, count):
+        """Ảnh ngẫu nhiên theo session → dHash / cache không gộp hết các lần nhận diện"""
+        from PIL import Image, ImageDraw
+
+        files = []
+        for i in range(count):
+            img = Image.new("RGB", (300, 400), tuple(self.rng.randrange(256) for _ in range(3)))
+            draw = ImageDraw.Draw(img)
+            for _ in range(6):  # ảnh một màu trùng dHash với nhau → vẽ thêm khối ngẫu nhiên
+                x, y = self.rng.randrange(250), self.rng.randrange(350)
+                draw.rectangle((x, y, x + 50, y + 50), fill=tuple(self.rng.randrange(256) for _ in range(3)))
+            buf = io.BytesIO()
+            img.save(buf, "JPEG")
+            files.append((f"session{self.index}-{i}.jpg", buf.getvalue(), "image/jpeg"))
+        return files
+
+    def _vision_pending(self):
+        return [k for k in self.at.session_state.jobs if k.startswith("vision:")]
+
+    def run(self):
+        at = self.at
+        self._timed("home", at.run)
+
+        self._timed("genre_open", lambda: self._goto("genre"))
+        genres = at.multiselect[0].options
+        at.multiselect[0].select(self.rng.choice([g for g in genres if g != "Hentai"]))
+        self._timed("genre_search", lambda: self._click("Search"))
+        if self._button("Load more"):
+            self._timed("genre_more", lambda: self._click("Load more"))
+
+        self._timed("recommend_open", lambda: self._goto("recommend"))
+        at.text_area[0].input(self.rng.choice(INTERESTS))
+        self._timed("recommend_submit", lambda: self._click("✨ Generate"))
+        self._timed("recommend_result", lambda: self._until(
+            lambda: any(m.value.startswith("**#1") for m in at.markdown), self.timeout))
+
+        self._timed("wiki_open", lambda: self._goto("wiki"))
+        self._timed("wiki_search", lambda: at.text_input(key="wiki_input").input(self.rng.choice(CHARACTERS)).run())
+        if self._button("Generate AI Profile"):
+            self._timed("wiki_profile", lambda: self._click("Generate AI Profile"))
+            self._timed("wiki_profile_result", lambda: self._until(lambda: len(at.success) > 0, self.timeout))
+
+        if self.vision_images:
+            self._timed("vision_upload", lambda: at.file_uploader[0].set_value(self._images(self.vision_images)).run())
+            self._timed("vision_identify", lambda: self._click("🔍 Identify"))
+            self._timed("vision_result", lambda: self._until(lambda: not self._vision_pending(), self.timeout))
+
+        self._timed("favorites_open", lambda: self._goto("favorites"))
+        return self.timings
+
+
+def percentile(values, q):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+
+def summarize(values):
+    return {
+        "n": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99),
+    }
+
+
+def git_commit():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return sha, dirty
+
+
+def gemini_config(args):
+    from stub_gemini import StubModelConfig
+
+    model_latency = {}
+    for item in args.gemini_model_latency:
+        name, _, seconds = item.partition("=")
+        model_latency[name] = float(seconds)
+    return StubModelConfig(latency=args.gemini_latency, error_429=args.gemini_429, model_latency=model_latency)
+
+
+def run_session(index, args):
+    """Một session trong process riêng; trả về timings và số liệu của process để gộp"""
+    os.chdir(ROOT)  # assets.py / storage.py tính path theo cwd
+    if BENCH_DIR not in sys.path:
+        sys.path.insert(0, BENCH_DIR)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from stub_gemini import install
+
+    model = install(gemini_config(args))
+    random.seed(args.seed + index)
+    # Process mới: import app + warmup không tính vào step "home" và bộ nhớ (như server đã chạy sẵn)
+    Session(index, args.timeout).at.run()
+    if not args.no_memory:
+        tracemalloc.start()
+    session = Session(index, args.timeout, args.vision_images)
+    result = {"timings": [], "error": None, "memory": None}
+    try:
+        result["timings"] = session.run()
+    except Exception as e:
+        result["timings"] = session.timings
+        result["error"] = f"session {index}: {type(e).__name__}: {e}"
+    if tracemalloc.is_tracing():
+        # Đo khi AppTest còn sống → bộ nhớ session còn giữ
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["memory"] = (current, peak)
+
+    from metrics import REGISTRY
+    from model_router import hedge_summary
+    retries = Counter()
+    for key, value in REGISTRY.counters("itook_external_retries_total").items():
+        retries[dict(key)["service"]] += value
+    result.update(gemini_calls=dict(model.calls), gemini_models=dict(model.model_calls),
+                  hedges=hedge_summary(), retries=dict(retries))
+    return result
+
+
+def run_benchmark(args):
+    from stub_jikan import StubConfig, StubJikanServer
+
+    os.chdir(ROOT)
+    server = StubJikanServer(StubConfig(latency=args.jikan_latency, error_429=args.jikan_429)).start()
+    prepare_environment(args, server)  # process con (spawn) thừa hưởng env này
+
+    timings = defaultdict(list)
+    errors = []
+    memory = []
+    totals = {key: Counter() for key in ("gemini_calls", "gemini_models", "hedges", "retries")}
+
+    started = time.perf_counter()
+    # max_tasks_per_child=1 → mỗi session một process mới, không chia state với session trước
+    with ProcessPoolExecutor(max_workers=args.concurrency, mp_context=get_context("spawn"),
+                             max_tasks_per_child=1) as pool:
+        futures = [pool.submit(run_session, i, args) for i in range(args.sessions)]
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:  # process con chết (vd. hết bộ nhớ)
+                errors.append(f"{type(e).__name__}: {e}")
+                continue
+            for step, seconds in result["timings"]:
+                timings[step].append(seconds)
+            if result["error"]:
+                errors.append(result["error"])
+            if result["memory"]:
+                memory.append(result["memory"])
+            for key, counter in totals.items():
+                counter.update(result[key])
+    wall = time.perf_counter() - started
+
+    commit, dirty = git_commit()
+    all_timings = [s for values in timings.values() for s in values]
+    return {
+        "commit": commit, "dirty": dirty, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args), "wall_seconds": wall,
+        "steps": {step: summarize(timings[step]) for step in STEPS if timings[step]},
+        "overall": summarize(all_timings),
+        "jikan_calls": dict(server.calls), "gemini_calls": dict(totals["gemini_calls"]),
+        "gemini_models": dict(totals["gemini_models"]), "hedges": dict(totals["hedges"]),
+        "retries": dict(totals["retries"]),
+        "memory": {
+            "retained_per_session_kb": sum(current for current, _ in memory) / 1024 / len(memory),
+            "peak_mb": max(peak for _, peak in memory) / 1024 / 1024,
+        } if memory else None,
+        "errors": errors,
+    }
+
+
+def _ms(value):
+    return "-" if value is None else f"{value * 1000:8.0f}"
+
+
+def print_report(result):
+    print(f"\ncommit {result['commit']}{' (dirty)' if result['dirty'] else ''} · "
+          f"{result['config']['sessions']} sessions × {result['config']['concurrency']} concurrent · "
+          f"{result['wall_seconds']:.1f}s wall")
+    print(f"{'step':<18}{'n':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for step, s in list(result["steps"].items()) + [("ALL", result["overall"])]:
+        print(f"{step:<18}{s['n']:>5} {_ms(s['p50'])} {_ms(s['p95'])} {_ms(s['p99'])}")
+    print(f"jikan calls:  {sum(result['jikan_calls'].values())} {result['jikan_calls']}")
+    print(f"gemini calls: {sum(result['gemini_calls'].values())} {result['gemini_calls']}")
+    print(f"gemini models: {result.get('gemini_models', {})} · hedges {result.get('hedges', {})}")
+    print(f"retries:      {result['retries']}")
+    if result["memory"]:
+        print(f"memory:       {result['memory']['retained_per_session_kb']:.0f} KB retained per session, "
+              f"peak {result['memory']['peak_mb']:.1f} MB")
+    for error in result["errors"][:10]:
+        print(f"ERROR {error}")
+
+
+def save_result(result, label=None):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    name = label or (result["commit"] + ("-dirty" if result["dirty"] else ""))
+    path = os.path.join(RESULTS_DIR, f"{name}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def load_result(ref):
+    path = ref if ref.endswith(".json") else os.path.join(RESULTS_DIR, f"{ref}.json")
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_comparison(base, new):
+    def _delta(old, cur):
+        if old is None or cur is None or not old:
+            return "     -"
+        return f"{(cur - old) / old * 100:+6.0f}%"
+
+    print(f"\nvs {base['commit']}{' (dirty)' if base['dirty'] else ''}")
+    print(f"{'step':<18}{'p50 ms':>22}{'p95 ms':>22}{'p99 ms':>22}")
+    rows = [(step, base["steps"].get(step), new["steps"].get(step)) for step in STEPS]
+    rows.append(("ALL", base["overall"], new["overall"]))
+    for step, old, cur in rows:
+        if not old or not cur:
+            continue
+        cells = [f"{_ms(old[q]).strip():>6} → {_ms(cur[q]).strip():<6}{_delta(old[q], cur[q])}" for q in ("p50", "p95", "p99")]
+        print(f"{step:<18}" + "".join(f"{c:>22}" for c in cells))
+    for key in ("jikan_calls", "gemini_calls"):
+        print(f"{key:<18}{sum(base[key].values()):>6} → {sum(new[key].values())}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sys.path.insert(0, BENCH_DIR)
+    # Đọc baseline trước: lần chạy này có thể ghi đè đúng file đó (cùng commit)
+    baseline = load_result(args.compare) if args.compare else None
+    result = run_benchmark(args)
+    print_report(result)
+    print(f"\nsaved {save_result(result, args.label)}")
+    if baseline:
+        print_comparison(baseline, result)
+    # Thread nền của app (prefetch, pool, metrics) là daemon nhưng executor thì không
+    os._exit(1 if result["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
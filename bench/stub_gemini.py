@@ -0,0 +1,109 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+import google.generativeai as genai
+
+# --- STUB GEMINI ---
+# Thay genai.GenerativeModel bằng model giả trong process: trả lời đúng định dạng
+# main.py chờ (JSON recommendations, tên nhân vật, profile, stream theo chunk),
+# có latency (riêng theo model nếu cần) và tỉ lệ 429 cấu hình được, đếm số lần
+# gọi theo loại và theo model.
+
+
+class StubModelConfig:
+    def __init__(self, latency=0.8, jitter=0.5, error_429=0.0, chunk_size=40, chunk_delay=0.02, model_latency=None):
+        self.latency = latency
+        self.model_latency = model_latency or {}  # model name -> latency, vd. làm chậm một tier để thử hedge
+        self.jitter = jitter
+        self.error_429 = error_429
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+
+
+class ResourceExhausted(Exception):
+    """Cùng message với lỗi quota của SDK để safe_api_call nhận ra"""
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class _Response:
+    def __init__(self, text, prompt_tokens):
+        self.text = text
+        self.usage_metadata = _Usage(prompt_tokens, max(1, len(text) // 4))
+
+
+class _Stream:
+    def __init__(self, text, prompt_tokens, config):
+        self._chunks = [text[i:i + config.chunk_size] for i in range(0, len(text), config.chunk_size)]
+        self._delay = config.chunk_delay
+        self.usage_metadata = _Usage(prompt_tokens, max(1, len(text) // 4))
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            time.sleep(self._delay)
+            yield _Response(chunk, 0)
+
+
+class StubGenerativeModel:
+    config = StubModelConfig()
+    calls = Counter()
+    model_calls = Counter()
+    _lock = threading.Lock()
+
+    def __init__(self, model_name, *args, **kwargs):
+        self.model_name = model_name
+
+    @classmethod
+    def count(cls, kind, model_name=None):
+        with cls._lock:
+            cls.calls[kind] += 1
+            if model_name:
+                cls.model_calls[model_name] += 1
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        parts = contents if isinstance(contents, list) else [contents]
+        prompt = next((p for p in parts if isinstance(p, str)), "")
+        kind, text = _answer(prompt)
+        self.count(kind, self.model_name)
+
+        config = self.config
+        latency = config.model_latency.get(self.model_name, config.latency)
+        time.sleep(max(0.0, latency * (1 + random.uniform(-config.jitter, config.jitter))))
+        if config.error_429 and random.random() < config.error_429:
+            self.count("429")
+            raise ResourceExhausted("429 Resource has been exhausted (e.g. check quota).")
+
+        prompt_tokens = len(prompt) // 4 + 258 * (len(parts) - 1)
+        if stream:
+            return _Stream(text, prompt_tokens, config)
+        return _Response(text, prompt_tokens)
+
+
+def _answer(prompt):
+    if "Recommend 5" in prompt:
+        return "recommend", json.dumps([
+            {"title": f"Stub Title {random.randint(0, 40)}", "genre": "Action", "reason": "Matches your mood."}
+            for _ in range(5)])
+    if "ONLY the character's full name" in prompt:
+        return "vision", "Naruto Uzumaki"
+    if "mapping each ID" in prompt:
+        ids = re.findall(r"^ID (\d+)", prompt, re.M)
+        return "profile_batch", json.dumps({i: f"🌟 Profile {i} 🔥 " + "lorem " * 80 for i in ids})
+    return "profile", "🌟 Legendary Hero 🔥\n\n" + "An energetic and loyal fighter. " * 25
+
+
+def install(config=None):
+    """Patch genai.GenerativeModel trước khi main.py tạo model"""
+    if config is not None:
+        StubGenerativeModel.config = config
+    genai.GenerativeModel = StubGenerativeModel
+    return StubGenerativeModel
@@ -0,0 +1,175 @@
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# --- STUB JIKAN v4 ---
+# Server HTTP local trả dữ liệu giả nhưng đúng hình dạng các endpoint main.py dùng.
+# Có latency cấu hình được, tỉ lệ 429 (kèm Retry-After) và ETag/304 như Jikan thật.
+
+NAMES = [
+    "Naruto Uzumaki", "Sasuke Uchiha", "Monkey D. Luffy", "Roronoa Zoro", "Levi Ackerman",
+    "Eren Yeager", "Mikasa Ackerman", "Light Yagami", "L Lawliet", "Son Goku", "Vegeta",
+    "Lelouch Lamperouge", "Edward Elric", "Spike Spiegel", "Saitama", "Killua Zoldyck",
+]
+GENRES = [(1, "Action"), (2, "Adventure"), (4, "Comedy"), (8, "Drama"), (10, "Fantasy"),
+          (22, "Romance"), (24, "Sci-Fi"), (36, "Slice of Life"), (12, "Hentai")]
+
+
+class StubConfig:
+    def __init__(self, latency=0.1, jitter=0.5, error_429=0.0, retry_after=1):
+        self.latency = latency  # giây trung bình mỗi request
+        self.jitter = jitter  # ± tỉ lệ ngẫu nhiên quanh latency
+        self.error_429 = error_429  # xác suất trả 429
+        self.retry_after = retry_after
+
+
+def character(i, base):
+    name = NAMES[i % len(NAMES)]
+    return {
+        "mal_id": i + 1, "name": name, "name_kanji": "漢字", "nicknames": [name.split()[0]],
+        "favorites": 100000 - i * 37, "url": f"https://myanimelist.net/character/{i + 1}",
+        "about": f"{name} is a main character. Brave, stubborn and loyal to friends. " * 12,
+        "images": {"jpg": {"image_url": f"{base}/img/c{i + 1}.jpg"}},
+    }
+
+
+def media(i, kind, base):
+    genres = [{"mal_id": 1, "name": "Action"}] + ([{"mal_id": 12, "name": "Hentai"}] if i % 7 == 0 else [])
+    return {
+        "mal_id": 1000 + i, "title": f"{kind.title()} {i}", "title_english": f"{kind.title()} EN {i}",
+        "score": round(5 + (i % 50) / 10, 2), "status": "Finished", "type": "TV",
+        "synopsis": "A long story about friendship and battles. " * 20,
+        "url": f"https://myanimelist.net/{kind}/{1000 + i}", "genres": genres,
+        "images": {"jpg": {"image_url": f"{base}/img/m{i}.jpg", "large_image_url": f"{base}/img/m{i}.jpg"}},
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        path = url.path.removeprefix("/v4")
+        config = self.server.config
+        self.server.count(path)
+
+        if config.latency:
+            time.sleep(max(0.0, config.latency * (1 + random.uniform(-config.jitter, config.jitter))))
+        if path.startswith("/img/"):
+            return self._send_image()
+        if config.error_429 and random.random() < config.error_429:
+            self.server.count("429")
+            self.send_response(429)
+            self.send_header("Retry-After", str(config.retry_after))
+            self.end_headers()
+            return
+
+        payload = self._route(path, q)
+        if payload is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self._send_json(payload)
+
+    def _route(self, path, q):
+        page, limit = int(q.get("page", 1)), int(q.get("limit", 25))
+        offset = (page - 1) * limit
+        if path.startswith("/genres/"):
+            return {"data": [{"mal_id": i, "name": n} for i, n in GENRES]}
+        if path == "/characters":
+            term = q.get("q", "").casefold().split()
+            hits = [character(i, self.base) for i, n in enumerate(NAMES) if term and term[0] in n.casefold()]
+            return {"data": hits[:limit], "pagination": {"has_next_page": False}}
+        if path.startswith("/characters/"):
+            return {"data": character(int(path.split("/")[2]) - 1, self.base)}
+        if path == "/top/characters":
+            return {"data": [character(offset + i, self.base) for i in range(limit)],
+                    "pagination": {"has_next_page": page < 4}}
+        if path in ("/anime", "/manga"):
+            kind = path[1:]
+            if q.get("q"):
+                return {"data": [dict(media(7, kind, self.base), title=q["q"], title_english=q["q"])]}
+            return {"data": [media(offset + i, kind, self.base) for i in range(limit)],
+                    "pagination": {"has_next_page": page < 5, "current_page": page}}
+        if path == "/top/manga":
+            return {"data": [media(offset + i, "manga", self.base) for i in range(limit)],
+                    "pagination": {"has_next_page": True}}
+        if path == "/random/manga":
+            return {"data": media(random.randint(0, 199), "manga", self.base)}
+        return None
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode()
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_image(self):
+        body = self.server.image_bytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubJikanServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config=None, port=0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.config = config or StubConfig()
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._image = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_port}/v4"
+
+    def count(self, path):
+        # /characters/17 → /characters/{id} để đếm theo endpoint
+        key = "/".join("{id}" if part.isdigit() else part for part in path.split("/"))
+        if key.startswith("/img/"):
+            key = "/img"
+        with self._lock:
+            self.calls[key] += 1
+
+    def image_bytes(self):
+        if self._image is None:
+            from PIL import Image
+            buf = io.BytesIO()
+            Image.new("RGB", (600, 900), (200, 80, 60)).save(buf, "JPEG", quality=80)
+            self._image = buf.getvalue()
+        return self._image
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="stub-jikan", daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    server = StubJikanServer(port=8765).start()
+    print(f"Stub Jikan on {server.base_url}  (JIKAN_BASE_URL={server.base_url})")
+    threading.Event().wait()
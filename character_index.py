@@ -0,0 +1,190 @@
+import argparse
+import bisect
+import json
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+from storage import connect
+
+# --- LOCAL CHARACTER NAME INDEX ---
+# Index tên nhân vật (name, kanji, nickname) gom từ dữ liệu Jikan, lưu SQLite.
+# Prefix tra bằng bisect trên danh sách term đã sort, gõ sai chính tả thì
+# dùng trigram; Jikan chỉ còn được gọi để lấy chi tiết nhân vật đã chọn.
+
+DB_FILE = "character_index.sqlite3"
+MIN_TRIGRAM_SIMILARITY = 0.35
+
+
+def normalize_name(text):
+    """'  Naruto  Uzumaki! ' → 'naruto uzumaki' (bỏ dấu, casefold, gộp khoảng trắng)"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text.casefold())
+    return " ".join(text.split())
+
+
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _summary(item):
+    """Phần dữ liệu cần cho gợi ý - chi tiết lấy từ Jikan khi người dùng chọn"""
+    return {
+        'mal_id': item['mal_id'],
+        'name': item.get('name') or "",
+        'name_kanji': item.get('name_kanji') or "",
+        'nicknames': list(item.get('nicknames') or []),
+        'favorites': item.get('favorites') or 0,
+        'image_url': item.get('images', {}).get('jpg', {}).get('image_url') or item.get('image_url'),
+    }
+
+
+class CharacterIndex:
+    def __init__(self, db_file=DB_FILE):
+        self._lock = threading.Lock()
+        self._conn = connect(db_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS characters (
+                mal_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            )""")
+        self._chars = {}  # mal_id -> summary
+        self._terms = []  # sorted [(term, mal_id)] cho prefix search
+        self._grams = defaultdict(set)  # trigram -> {(term, mal_id)}
+        self._id_grams = {}  # mal_id -> các trigram key đã thêm, để xoá nhanh
+        for (data,) in self._conn.execute("SELECT data FROM characters"):
+            self._add(json.loads(data))
+        self._terms.sort()
+
+    def __len__(self):
+        return len(self._chars)
+
+    def _names(self, summary):
+        names = [summary['name'], summary['name_kanji'], *summary['nicknames']]
+        # "Uzumaki, Naruto" và "Naruto Uzumaki" đều phải khớp
+        if "," in summary['name']:
+            last, _, first = summary['name'].partition(",")
+            names.append(f"{first} {last}")
+        return names
+
+    def _add(self, summary):
+        """Thêm vào index; caller phải sort lại self._terms sau khi thêm xong một lô"""
+        mal_id = summary['mal_id']
+        if mal_id in self._chars:
+            self._remove(mal_id)
+        self._chars[mal_id] = summary
+        gram_keys = self._id_grams[mal_id] = set()
+        for name in self._names(summary):
+            full = normalize_name(name)
+            if not full:
+                continue
+            words = full.split()
+            # Mỗi hậu tố theo từ cũng là một term: gõ "uzumaki" vẫn ra "Naruto Uzumaki"
+            for i in range(len(words)):
+                self._terms.append((" ".join(words[i:]), mal_id))
+            # Trigram cho cả tên đầy đủ lẫn từng từ: "naruot" vẫn gần "naruto"
+            for term in {full, *words}:
+                for g in trigrams(term):
+                    self._grams[g].add((term, mal_id))
+                    gram_keys.add(g)
+
+    def _remove(self, mal_id):
+        self._terms = [t for t in self._terms if t[1] != mal_id]
+        for g in self._id_grams.pop(mal_id, ()):
+            self._grams[g] = {t for t in self._grams[g] if t[1] != mal_id}
+        self._chars.pop(mal_id, None)
+
+    def harvest(self, items):
+        """Thêm / cập nhật nhân vật từ response Jikan (list dict có mal_id, name, ...)"""
+        rows = []
+        with self._lock:
+            for item in items or []:
+                if not item or 'mal_id' not in item:
+                    continue
+                summary = _summary(item)
+                if self._chars.get(summary['mal_id']) == summary:
+                    continue
+                self._add(summary)
+                rows.append((summary['mal_id'], json.dumps(summary, ensure_ascii=False)))
+            if rows:
+                self._terms.sort()
+                self._conn.executemany("INSERT OR REPLACE INTO characters (mal_id, data) VALUES (?, ?)", rows)
+        return len(rows)
+
+    def search(self, query, limit=10, fuzzy=True):
+        """Prefix trước, sau đó fuzzy theo trigram (fuzzy=False: chỉ khớp / prefix); phổ biến hơn đứng trước"""
+        q = normalize_name(query)
+        if not q:
+            return []
+        scores = {}
+        with self._lock:
+            i = bisect.bisect_left(self._terms, (q,))
+            while i < len(self._terms) and self._terms[i][0].startswith(q):
+                term, mal_id = self._terms[i]
+                scores[mal_id] = max(scores.get(mal_id, 0), 2.0 if term == q else 1.5)
+                i += 1
+
+            if fuzzy and len(scores) < limit:
+                q_grams = trigrams(q)
+                overlap = defaultdict(int)
+                for g in q_grams:
+                    for entry in self._grams.get(g, ()):
+                        overlap[entry] += 1
+                min_shared = MIN_TRIGRAM_SIMILARITY * len(q_grams)  # similarity ≤ shared / |q_grams|
+                for (term, mal_id), shared in overlap.items():
+                    if shared < min_shared:
+                        continue
+                    similarity = shared / len(q_grams | trigrams(term))
+                    if similarity >= MIN_TRIGRAM_SIMILARITY:
+                        scores[mal_id] = max(scores.get(mal_id, 0), similarity)
+
+            ranked = sorted(scores, key=lambda m: (-scores[m], -self._chars[m]['favorites']))
+            return [self._chars[m] for m in ranked[:limit]]
+
+    def best_match(self, query):
+        """Nhân vật có tên khớp chính xác (sau normalize), hoặc None"""
+        q = normalize_name(query)
+        for summary in self.search(query, limit=5):
+            if any(normalize_name(n) == q for n in self._names(summary)):
+                return summary
+        return None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_character_index():
+    """Process-wide CharacterIndex, load từ đĩa lần đầu gọi"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CharacterIndex()
+        return _index
+
+
+def harvest_top_characters(pages=20):
+    """Gom nhân vật phổ biến nhất từ /top/characters vào index"""
+    from jikan_client import get_client
+
+    index = get_character_index()
+    added = 0
+    for page in range(1, pages + 1):
+        payload = get_client().get("top/characters", params={'page': page, 'limit': 25})
+        if payload is None:
+            break
+        added += index.harvest(payload.get('data', []))
+        if not payload.get('pagination', {}).get('has_next_page'):
+            break
+    return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local character name index from Jikan")
+    parser.add_argument("--pages", type=int, default=20, help="pages of /top/characters to harvest (25 each)")
+    args = parser.parse_args()
+    added = harvest_top_characters(args.pages)
+    print(f"Harvested {added} characters, index size {len(get_character_index())}")
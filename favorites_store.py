@@ -0,0 +1,132 @@
+import json
+import threading
+from collections import OrderedDict
+
+from storage import connect
+
+# --- FAVORITES STORE ---
+# Favorites theo user: index dict theo id cho mỗi category (O(1) thay vì quét
+# list), lưu SQLite nên còn sau khi session kết thúc, load lười lần đầu dùng.
+
+DB_FILE = "favorites.sqlite3"
+CATEGORIES = ('media', 'characters')
+
+_conn = None
+_conn_lock = threading.RLock()
+
+
+def _db():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = connect(DB_FILE)
+            _conn.execute("""
+                CREATE TABLE IF NOT EXISTS favorites (
+                    user_id TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    added_at TEXT,
+                    PRIMARY KEY (user_id, category, item_id)
+                )""")
+        return _conn
+
+
+def item_key(item_id):
+    """Id Jikan có lúc là int, lúc là str → chuẩn hoá một lần khi ghi/đọc"""
+    return str(item_id)
+
+
+class FavoritesStore:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._items = None  # category -> OrderedDict(item_key -> item), thứ tự thêm vào
+
+    def _load(self):
+        if self._items is not None:
+            return
+        self._items = {c: OrderedDict() for c in CATEGORIES}
+        with _conn_lock:
+            rows = _db().execute(
+                "SELECT category, item_id, data FROM favorites WHERE user_id = ? ORDER BY rowid",
+                (self.user_id,)).fetchall()
+        for category, key, data in rows:
+            self._items.setdefault(category, OrderedDict())[key] = json.loads(data)
+
+    def contains(self, category, item_id):
+        self._load()
+        return item_key(item_id) in self._items.get(category, {})
+
+    def items(self, category):
+        self._load()
+        return list(self._items.get(category, {}).values())
+
+    def count(self, category):
+        self._load()
+        return len(self._items.get(category, {}))
+
+    def kinds(self, category):
+        """Các media_type có trong category (TV, Movie, Manga...) cho bộ lọc"""
+        self._load()
+        return sorted({i.get('media_type') or 'Unknown' for i in self._items.get(category, {}).values()})
+
+    def query(self, category, text=None, kind=None, sort="recent", offset=0, limit=12):
+        """
+        Một trang favorites đã lọc + sắp xếp: trả về (items, tổng số khớp).
+        sort: recent | oldest | score | title. Chỉ slice [offset:offset+limit] được trả về.
+        """
+        self._load()
+        items = list(self._items.get(category, {}).values())  # thứ tự thêm vào
+        if text:
+            needle = text.casefold()
+            items = [i for i in items if needle in (i.get('title') or '').casefold()]
+        if kind:
+            items = [i for i in items if (i.get('media_type') or 'Unknown') == kind]
+        if sort == "recent":
+            items.reverse()
+        elif sort == "score":
+            items.sort(key=lambda i: i.get('score') or 0, reverse=True)
+        elif sort == "title":
+            items.sort(key=lambda i: (i.get('title') or '').casefold())
+        # "oldest" = thứ tự thêm vào
+        return items[offset:offset + limit], len(items)
+
+    def add(self, category, item):
+        self.add_many(category, [item])
+
+    def remove(self, category, item_id):
+        self.remove_many(category, [item_id])
+
+    def add_many(self, category, items):
+        self._load()
+        bucket = self._items.setdefault(category, OrderedDict())
+        rows = []
+        for item in items:
+            key = item_key(item['mal_id'])
+            bucket[key] = item
+            rows.append((self.user_id, category, key, json.dumps(item, ensure_ascii=False), item.get('added_at')))
+        with _conn_lock:
+            _db().executemany(
+                "INSERT OR REPLACE INTO favorites (user_id, category, item_id, data, added_at) VALUES (?, ?, ?, ?, ?)",
+                rows)
+
+    def remove_many(self, category, item_ids):
+        self._load()
+        bucket = self._items.get(category, {})
+        keys = [item_key(i) for i in item_ids]
+        for key in keys:
+            bucket.pop(key, None)
+        with _conn_lock:
+            _db().executemany(
+                "DELETE FROM favorites WHERE user_id = ? AND category = ? AND item_id = ?",
+                [(self.user_id, category, key) for key in keys])
+
+    def clear(self, category=None):
+        self._load()
+        categories = [category] if category else list(self._items)
+        for c in categories:
+            self._items[c] = OrderedDict()
+        with _conn_lock:
+            _db().executemany(
+                "DELETE FROM favorites WHERE user_id = ? AND category = ?",
+                [(self.user_id, c) for c in categories])
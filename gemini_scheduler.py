@@ -0,0 +1,142 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError
+
+# --- GEMINI SCHEDULER ---
+# Quota Gemini tính theo API key chứ không theo user → một scheduler cho cả
+# process: hàng đợi ưu tiên (interactive trước background), admit theo
+# ngân sách RPM/TPM trong cửa sổ 60s, và ước lượng thời gian chờ cho UI.
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+RPM_LIMIT = int(os.environ.get("GEMINI_RPM", 15))
+TPM_LIMIT = int(os.environ.get("GEMINI_TPM", 250_000))
+WINDOW = 60.0
+ABORT_POLL = 0.25  # giây; chu kỳ kiểm tra abort khi đang chờ admit
+
+
+def estimate_tokens(text, expected_output=500):
+    """Ước lượng thô ~4 ký tự / token, cộng phần output dự kiến"""
+    return len(text) // 4 + expected_output
+
+
+class Admission:
+    """Một lượt gọi đã được admit; settle() cập nhật số token thực tế"""
+
+    def __init__(self, at, tokens):
+        self.at = at
+        self.tokens = tokens
+
+    def settle(self, actual_tokens):
+        if actual_tokens:
+            self.tokens = actual_tokens
+
+
+class GeminiScheduler:
+    def __init__(self, rpm=RPM_LIMIT, tpm=TPM_LIMIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_interval = WINDOW / rpm  # rải đều thay vì burst cả quota một lúc
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._window = deque()  # Admission trong 60s gần nhất
+        self._last_admit = 0.0
+        self._paused_until = 0.0
+
+    def _prune(self, now):
+        while self._window and now - self._window[0].at >= WINDOW:
+            self._window.popleft()
+
+    def _budget_wait(self, now, tokens):
+        """Số giây cho tới khi một request `tokens` lọt ngân sách (0 = ngay)"""
+        self._prune(now)
+        wait = max(0.0, self._paused_until - now, self._last_admit + self.min_interval - now)
+        if len(self._window) >= self.rpm:
+            wait = max(wait, self._window[len(self._window) - self.rpm].at + WINDOW - now)
+        used = sum(a.tokens for a in self._window)
+        if used + tokens > self.tpm:
+            for a in self._window:
+                used -= a.tokens
+                if used + tokens <= self.tpm:
+                    wait = max(wait, a.at + WINDOW - now)
+                    break
+        return wait
+
+    def estimate_wait(self, priority=PRIORITY_INTERACTIVE, tokens=1000):
+        """Ước lượng giây phải chờ nếu xếp hàng bây giờ - để hiển thị trên UI"""
+        with self._cond:
+            now = time.monotonic()
+            ahead = sum(1 for p, _ in self._queue if p <= priority)
+            return self._budget_wait(now, tokens) + ahead * self.min_interval
+
+    def admit(self, priority=PRIORITY_INTERACTIVE, tokens=1000, abort=None):
+        """Chặn tới khi tới lượt và còn ngân sách; trả về Admission.
+
+        abort: threading.Event tuỳ chọn - set thì rời hàng đợi và raise CancelledError.
+        """
+        with self._cond:
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    if abort is not None and abort.is_set():
+                        raise CancelledError()
+                    now = time.monotonic()
+                    if self._queue[0] == entry:
+                        wait = self._budget_wait(now, tokens)
+                        if wait <= 0:
+                            heapq.heappop(self._queue)
+                            admission = Admission(now, tokens)
+                            self._window.append(admission)
+                            self._last_admit = now
+                            return admission
+                        self._cond.wait(wait if abort is None else min(wait, ABORT_POLL))
+                    else:
+                        self._cond.wait(None if abort is None else ABORT_POLL)
+            except BaseException:
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                raise
+            finally:
+                self._cond.notify_all()
+
+    def try_admit(self, priority=PRIORITY_INTERACTIVE, tokens=1000):
+        """Admit ngay nếu không ai đang xếp hàng và còn ngân sách, không thì None (không chờ)"""
+        with self._cond:
+            now = time.monotonic()
+            if any(p <= priority for p, _ in self._queue) or self._budget_wait(now, tokens) > 0:
+                return None
+            admission = Admission(now, tokens)
+            self._window.append(admission)
+            self._last_admit = now
+            return admission
+
+    def pause(self, seconds):
+        """Gemini trả 429 → dừng admit cho mọi caller trong `seconds` giây"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def queue_length(self):
+        with self._cond:
+            return len(self._queue)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Process-wide GeminiScheduler"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = GeminiScheduler()
+        return _scheduler
@@ -0,0 +1,137 @@
+import json
+import threading
+from collections import Counter, deque
+from datetime import datetime
+
+from ai_service import prefetch_ai_profile
+from jikan_client import get_client
+from jikan_services import prefetch_genre_page
+from storage import connect
+from workers import get_executor
+
+# --- HISTORY & ACCESS PATTERNS ---
+# Lịch sử mỗi session là ring buffer 50 mục. Mô hình truy cập cho cả process
+# ("ai xem X thường xem Y tiếp", genre mà user hay chọn) quyết định prefetch
+# Jikan / AI profile ở background để click tiếp theo thường là cache hit.
+
+HISTORY_SIZE = 50
+DB_FILE = "access_model.sqlite3"
+PREFETCH_MIN_COUNT = 2  # chuyển tiếp X → Y phải xảy ra ít nhất 2 lần mới prefetch Jikan
+PROFILE_PREFETCH_MIN_COUNT = 4  # AI profile tốn quota → ngưỡng cao hơn
+
+
+class SessionHistory:
+    """Ring buffer lịch sử của một session (mới nhất đứng đầu)"""
+
+    def __init__(self, maxlen=HISTORY_SIZE):
+        self._entries = deque(maxlen=maxlen)
+
+    def add(self, action_type, query, details=None):
+        self._entries.appendleft({
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'type': action_type, 'query': query, 'details': details
+        })
+
+    def last(self, action_type):
+        return next((e for e in self._entries if e['type'] == action_type), None)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class AccessModel:
+    def __init__(self, db_file=DB_FILE):
+        self._lock = threading.Lock()
+        self._conn = connect(db_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS char_transitions (
+                prev_id INTEGER NOT NULL,
+                next_id INTEGER NOT NULL,
+                next_name TEXT,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (prev_id, next_id)
+            )""")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS genre_picks (
+                user_id TEXT NOT NULL,
+                query TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (user_id, query)
+            )""")
+        self._transitions = {}  # prev_id -> Counter(next_id)
+        for prev_id, next_id, count in self._conn.execute(
+                "SELECT prev_id, next_id, count FROM char_transitions"):
+            self._transitions.setdefault(prev_id, Counter())[next_id] = count
+
+    def record_transition(self, prev_id, next_id, next_name=None):
+        if prev_id is None or prev_id == next_id:
+            return
+        with self._lock:
+            self._transitions.setdefault(prev_id, Counter())[next_id] += 1
+            self._conn.execute(
+                "INSERT INTO char_transitions (prev_id, next_id, next_name, count) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (prev_id, next_id) DO UPDATE SET count = count + 1, next_name = excluded.next_name",
+                (prev_id, next_id, next_name))
+
+    def predict_next(self, char_id, k=2, min_count=PREFETCH_MIN_COUNT):
+        """[(next_id, count)] phổ biến nhất sau char_id"""
+        with self._lock:
+            counts = self._transitions.get(char_id)
+            if not counts:
+                return []
+            return [(cid, n) for cid, n in counts.most_common(k) if n >= min_count]
+
+    def record_genre_query(self, user_id, query):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO genre_picks (user_id, query, count) VALUES (?, ?, 1) "
+                "ON CONFLICT (user_id, query) DO UPDATE SET count = count + 1",
+                (user_id, json.dumps(query)))
+
+    def top_genre_queries(self, user_id, k=1):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT query FROM genre_picks WHERE user_id = ? ORDER BY count DESC LIMIT ?",
+                (user_id, k)).fetchall()
+        return [_decode_query(q) for (q,) in rows]
+
+
+def _decode_query(raw):
+    """JSON [ctype, [ids], order, sort] → tuple query của genre_results"""
+    ctype, ids, order, sort = json.loads(raw)
+    return ctype, tuple(ids), order, sort
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_access_model():
+    """Process-wide AccessModel"""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = AccessModel()
+        return _model
+
+
+# --- PREDICTIVE PREFETCH ---
+
+def prefetch_after_character(char_id):
+    """Prefetch chi tiết (và AI profile nếu rất hay xem) các nhân vật thường được xem sau char_id"""
+    def _prefetch(next_id, count):
+        payload = get_client().get(f"characters/{next_id}")
+        if payload and count >= PROFILE_PREFETCH_MIN_COUNT:
+            prefetch_ai_profile(payload.get('data') or {})
+
+    for next_id, count in get_access_model().predict_next(char_id):
+        get_executor("predict", max_workers=2).submit(_prefetch, next_id, count)
+
+
+def prefetch_favourite_genres(user_id):
+    """Prefetch trang đầu của query genre user hay chọn nhất"""
+    for query in get_access_model().top_genre_queries(user_id):
+        prefetch_genre_page(*query, 1)
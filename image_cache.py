@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import threading
+import time
+from io import BytesIO
+
+import requests
+from PIL import Image
+
+from metrics import cache_result
+from storage import connect
+from workers import get_executor
+
+log = logging.getLogger(__name__)
+
+# --- THUMBNAIL PROXY CACHE ---
+# Ảnh bìa / nhân vật từ CDN của MAL được tải một lần, thu nhỏ theo kích thước
+# hiển thị, lưu SQLite (LRU, giới hạn dung lượng) rồi đưa bytes cho st.image.
+# Lần đầu gặp một ảnh: trả URL gốc ngay và tải ở background → không chặn render.
+
+DB_FILE = "thumbnails.sqlite3"
+MAX_BYTES = 128 * 1024 * 1024
+TIMEOUT = (3.05, 10)
+QUALITY = 80
+
+# Cạnh dài tối đa (px) theo chỗ hiển thị, đã tính màn hình HiDPI
+SIZES = {
+    "grid": 320,  # lưới favorites
+    "card": 360,  # card genre / recommendation
+    "profile": 600,  # ảnh nhân vật trang wiki
+    "hero": 720,  # Manga of the Day
+}
+
+
+def thumb_key(url, size):
+    return f"{size}:{hashlib.sha256(url.encode()).hexdigest()}"
+
+
+def make_thumbnail(data, max_side):
+    """
+    Bytes ảnh gốc → JPEG (PNG nếu có alpha) có cạnh dài ≤ max_side.
+    st.image chỉ giữ nguyên bytes JPEG/PNG/GIF; định dạng khác (WebP) bị decode
+    và nén lại mỗi lần render → lưu sẵn đúng định dạng nó dùng.
+    """
+    img = Image.open(BytesIO(data))
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    out = BytesIO()
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img.convert("RGBA").save(out, "PNG", optimize=True)
+    else:
+        img.convert("RGB").save(out, "JPEG", quality=QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+class ThumbnailCache:
+    def __init__(self, db_file=DB_FILE, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = connect(db_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_thumbnails_access ON thumbnails(last_access)")
+        self._session = requests.Session()
+        self._fetching = set()
+
+    def get(self, url, size="grid"):
+        """Bytes thumbnail đã cache, hoặc None"""
+        key = thumb_key(url, size)
+        with self._lock:
+            row = self._conn.execute("SELECT body FROM thumbnails WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE thumbnails SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0] if row else None
+
+    def fetch(self, url, size="grid"):
+        """Tải + thu nhỏ + lưu (blocking); trả bytes hoặc None nếu lỗi"""
+        try:
+            response = self._session.get(url, timeout=TIMEOUT)
+            response.raise_for_status()
+            body = make_thumbnail(response.content, SIZES[size])
+        except (requests.RequestException, OSError) as e:
+            log.warning("%s: %s: %s", url, type(e).__name__, e)
+            return None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO thumbnails (key, url, body, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (thumb_key(url, size), url, body, len(body), time.time()))
+            self._evict()
+        return body
+
+    def prefetch(self, url, size="grid"):
+        """Tải ở background, mỗi (url, size) chỉ một lần tại một thời điểm"""
+        key = thumb_key(url, size)
+        with self._lock:
+            if key in self._fetching:
+                return
+            self._fetching.add(key)
+
+        def _fetch():
+            try:
+                self.fetch(url, size)
+            finally:
+                with self._lock:
+                    self._fetching.discard(key)
+
+        get_executor("thumbnails", max_workers=4).submit(_fetch)
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM thumbnails").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Xoá theo LRU tới khi còn 90% dung lượng
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM thumbnails ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM thumbnails WHERE key = ?", victims)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache():
+    """Process-wide ThumbnailCache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ThumbnailCache()
+        return _cache
+
+
+def thumbnail(url, size="grid"):
+    """
+    Nguồn ảnh cho st.image: bytes thumbnail nếu đã cache, nếu chưa thì URL gốc
+    (và tải thumbnail ở background cho lần render sau).
+    """
+    if not url:
+        return None
+    cache = get_thumbnail_cache()
+    body = cache.get(url, size)
+    cache_result("thumbnail", body is not None)
+    if body is not None:
+        return body
+    cache.prefetch(url, size)
+    return url
@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from urllib.parse import urlencode
+
+from storage import connect
+
+# --- PERSISTENT JIKAN RESPONSE CACHE ---
+# SQLite cache sống qua restart/redeploy: TTL theo endpoint, revalidate bằng
+# ETag, trả bản stale ngay lập tức trong lúc refresh ở background.
+
+DB_FILE = "jikan_cache.sqlite3"
+MAX_BYTES = 64 * 1024 * 1024
+MAX_STALE = 7 * 86400  # quá hạn này thì phải revalidate đồng bộ
+
+# (path prefix, ttl seconds) - prefix dài hơn đứng trước; ttl 0 = không cache
+TTL_RULES = [
+    ("random/", 0),
+    ("genres/", 7 * 86400),
+    ("top/", 6 * 3600),
+    ("characters", 24 * 3600),
+    ("anime", 3600),
+    ("manga", 3600),
+]
+DEFAULT_TTL = 3600
+
+
+def ttl_for(path):
+    path = path.lstrip("/")
+    for prefix, ttl in TTL_RULES:
+        if path.startswith(prefix):
+            return ttl
+    return DEFAULT_TTL
+
+
+def cache_key(path, params=None):
+    path = path.lstrip("/")
+    if not params:
+        return path
+    return f"{path}?{urlencode(sorted(params.items()))}"
+
+
+class CacheEntry:
+    def __init__(self, payload, etag, stored_at, ttl):
+        self.payload = payload
+        self.etag = etag
+        self.age = time.time() - stored_at
+        self.ttl = ttl
+
+    @property
+    def fresh(self):
+        return self.age < self.ttl
+
+    @property
+    def servable(self):
+        return self.age < self.ttl + MAX_STALE
+
+
+class JikanCache:
+    def __init__(self, db_file=DB_FILE, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = connect(db_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                body TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+
+    def lookup(self, key, ttl):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return CacheEntry(json.loads(row[0]), row[1], row[2], ttl)
+
+    def store(self, key, payload, etag=None):
+        body = json.dumps(payload, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, etag, body, size, stored_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, etag, body, len(body), now, now))
+            self._evict()
+
+    def touch(self, key):
+        """304 Not Modified → bản cache còn đúng, gia hạn TTL"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE responses SET stored_at = ?, last_access = ? WHERE key = ?", (now, now, key))
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Xoá theo LRU tới khi còn 90% dung lượng
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
@@ -0,0 +1,229 @@
+import logging
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+from jikan_cache import JikanCache, cache_key, ttl_for
+from metrics import Timer, cache_result, endpoint_label, record_backoff, record_request, record_retry
+from workers import get_executor
+
+log = logging.getLogger(__name__)
+
+# --- JIKAN HTTP CLIENT ---
+# Một client dùng chung cho cả process: connection pool keep-alive, timeout,
+# và rate limiter chung cho mọi session Streamlit (Jikan: 3 req/s, 60 req/min).
+# Response được cache trên đĩa (jikan_cache) với revalidate bằng ETag.
+# JIKAN_BASE_URL trỏ client sang mirror / stub server (bench/).
+# Việc nền (background=True, vd. fill pool random manga) chỉ dùng slot đang rảnh,
+# không xếp hàng trước request của user.
+
+BASE_URL = os.environ.get("JIKAN_BASE_URL", "https://api.jikan.moe/v4")
+TIMEOUT = (3.05, 10)  # (connect, read) seconds
+POOL_SIZE = 10
+MAX_RETRIES = 2
+BACKGROUND_MAX_WAIT = 30.0  # việc nền chờ slot rảnh tối đa bấy nhiêu giây rồi bỏ
+BACKGROUND_POLL = 0.25
+BACKGROUND_HEADROOM = 2  # việc nền chỉ chạy khi burst còn đủ cho 2 request của user
+
+
+class TokenBucket:
+    """Token bucket in GCRA form: `rate` tokens per `per` seconds, bursts up to `burst`"""
+
+    def __init__(self, rate, per, burst=None):
+        self.interval = per / rate
+        self.burst = burst or rate
+        self.tat = 0.0  # theoretical arrival time of the next token
+
+    def earliest(self, now):
+        return max(now, self.tat - self.interval * (self.burst - 1))
+
+    def available(self, now, n=1):
+        """Lấy được n token ngay lúc now mà không phải chờ"""
+        return max(self.tat, now) + self.interval * (n - 1) - self.interval * (self.burst - 1) <= now
+
+    def consume(self, at):
+        self.tat = max(self.tat, at) + self.interval
+
+
+class RateLimiter:
+    """Reserve a slot in every bucket under one lock, so callers are served in arrival order"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reserve the next free slot, return seconds the caller must wait"""
+        with self._lock:
+            now = time.monotonic()
+            at = max(b.earliest(now) for b in self.buckets)
+            for b in self.buckets:
+                b.consume(at)
+        return at - now
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def try_acquire(self, headroom=1):
+        """Lấy slot chỉ khi có ngay và vẫn còn `headroom` slot trống cho caller khác; không bao giờ chờ"""
+        with self._lock:
+            now = time.monotonic()
+            if not all(b.available(now, 1 + headroom) for b in self.buckets):
+                return False
+            for b in self.buckets:
+                b.consume(now)
+        return True
+
+    def penalize(self, seconds):
+        """Server trả 429 → đẩy lùi toàn bộ hàng đợi"""
+        with self._lock:
+            resume = time.monotonic() + seconds
+            for b in self.buckets:
+                b.tat = max(b.tat, resume + b.interval * (b.burst - 1))
+
+
+def jikan_rate_limiter():
+    return RateLimiter([TokenBucket(3, 1.0), TokenBucket(60, 60.0, burst=3)])
+
+
+class JikanClient:
+    def __init__(self, base_url=BASE_URL, timeout=TIMEOUT, pool_size=POOL_SIZE, limiter=None, cache=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.limiter = limiter or jikan_rate_limiter()
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+
+    def get(self, path, params=None, background=False):
+        """
+        GET một endpoint Jikan, trả về JSON đã parse hoặc None nếu lỗi.
+        background: chỉ gọi khi rate limiter có slot rảnh (None nếu chờ quá BACKGROUND_MAX_WAIT).
+        """
+        ttl = ttl_for(path)
+        if self.cache is None or ttl <= 0:
+            response = self._request(path, params, background=background)
+            return _json_or_none(response)
+
+        key = cache_key(path, params)
+        entry = self.cache.lookup(key, ttl)
+        cache_result("jikan", entry is not None and entry.servable)
+        if entry is not None and entry.fresh:
+            return entry.payload
+        if entry is not None and entry.servable:
+            # Stale-while-revalidate: trả bản cũ ngay, refresh ở background
+            self._refresh_in_background(path, params, key, entry.etag)
+            return entry.payload
+        payload = self._revalidate(path, params, key, entry.etag if entry else None, background)
+        if payload is None and entry is not None:
+            return entry.payload
+        return payload
+
+    def _revalidate(self, path, params, key, etag, background=False):
+        headers = {"If-None-Match": etag} if etag else None
+        response = self._request(path, params, headers=headers, background=background)
+        if response is None:
+            return None
+        if response.status_code == 304:
+            self.cache.touch(key)
+            entry = self.cache.lookup(key, ttl_for(path))
+            return entry.payload if entry else None
+        payload = _json_or_none(response)
+        if payload is not None:
+            self.cache.store(key, payload, response.headers.get("ETag"))
+        return payload
+
+    def _refresh_in_background(self, path, params, key, etag):
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _refresh():
+            try:
+                self._revalidate(path, params, key, etag)
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+
+        get_executor("jikan-refresh", max_workers=2).submit(_refresh)
+
+    def _wait_spare_slot(self):
+        """Việc nền: chờ tới khi rate limiter có slot rảnh; False nếu quá BACKGROUND_MAX_WAIT"""
+        deadline = time.monotonic() + BACKGROUND_MAX_WAIT
+        while not self.limiter.try_acquire(BACKGROUND_HEADROOM):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(BACKGROUND_POLL)
+        return True
+
+    def _request(self, path, params=None, headers=None, background=False):
+        """Gọi HTTP qua rate limiter, retry 429/5xx; trả về Response (200/304/4xx) hoặc None"""
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        endpoint = endpoint_label(path)
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt:
+                record_retry("jikan", endpoint, reason)
+            if not background:
+                self.limiter.acquire()
+            elif not self._wait_spare_slot():
+                log.debug("%s: no spare rate limit, skipping background request", endpoint)
+                return None
+            timer = Timer()
+            try:
+                with timer:
+                    response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                record_request("jikan", endpoint, "error", timer.seconds)
+                log.warning("%s: %s: %s", endpoint, type(e).__name__, e)
+                reason = "error"
+                continue
+            record_request("jikan", endpoint, response.status_code, timer.seconds)
+            if response.status_code == 429 or response.status_code >= 500:
+                delay = _retry_after(response, default=1.0 * (attempt + 1))
+                self.limiter.penalize(delay)
+                record_backoff("jikan", delay)
+                reason = str(response.status_code)
+                continue
+            return response
+        log.warning("%s: giving up after %d attempts", endpoint, MAX_RETRIES + 1)
+        return None
+
+
+def _json_or_none(response):
+    if response is None or response.status_code != 200:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        log.warning("invalid JSON from %s", response.url)
+        return None
+
+
+def _retry_after(response, default):
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except ValueError:
+        return default
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide JikanClient (dùng được cả từ background thread)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = JikanClient(cache=JikanCache())
+        return _client
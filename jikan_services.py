@@ -1,43 +1,240 @@
-import requests
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date
 import streamlit as st
+from jikan_client import get_client
+from character_index import get_character_index, normalize_name
+from metrics import REGISTRY, cache_lookup, cache_miss, cache_result
+from workers import get_executor
 
 # # Jikan API Services
+GENRE_CACHE_TTL = 3600
+
+class JikanUnavailable(Exception):
+    """Jikan lỗi / không trả lời: raise trong hàm @st.cache_data để lỗi không bị cache"""
 
-@st.cache_data(ttl=3600)
 def get_genre_map(content_type="anime"):
-    url = f"https://api.jikan.moe/v4/genres/{content_type}"
+    """{tên genre: mal_id}; {} nếu Jikan lỗi (không cache → lần render sau thử lại)"""
+    cache_lookup("genre_map")
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json().get('data', [])
-            return {item['name']: item['mal_id'] for item in data}
+        return _get_genre_map(content_type)
+    except JikanUnavailable:
         return {}
-    except: return {}
 
-@st.cache_data(ttl=3600)
+@st.cache_data(ttl=GENRE_CACHE_TTL)
+def _get_genre_map(content_type):
+    cache_miss("genre_map")
+    payload = get_client().get(f"genres/{content_type}")
+    if payload is None: raise JikanUnavailable(f"genres/{content_type}")
+    data = payload.get('data', [])
+    return {item['name']: item['mal_id'] for item in data}
+
 def get_character_data(name):
-    url = f"https://api.jikan.moe/v4/characters?q={name}&limit=10"
+    """Tìm nhân vật qua Jikan - key cache đã normalize nên 'naruto' và 'Naruto ' là một"""
+    cache_lookup("character_search")
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json().get('data', [])
+        return _search_characters(normalize_name(name))
+    except JikanUnavailable:
         return []
-    except: return []
+
+@st.cache_data(ttl=3600)
+def _search_characters(query):
+    cache_miss("character_search")
+    payload = get_client().get("characters", params={'q': query, 'limit': 10})
+    if payload is None: raise JikanUnavailable("characters")
+    data = payload.get('data', [])
+    get_character_index().harvest(data)
+    return data
+
+def get_character_by_id(mal_id):
+    cache_lookup("character")
+    try:
+        return _get_character_by_id(mal_id)
+    except JikanUnavailable:
+        return None
+
+@st.cache_data(ttl=3600)
+def _get_character_by_id(mal_id):
+    cache_miss("character")
+    payload = get_client().get(f"characters/{mal_id}")
+    if payload is None: raise JikanUnavailable(f"characters/{mal_id}")
+    return payload.get('data')
 
 def get_one_character_data(name):
+    # Tên khớp chính xác trong index local → chỉ cần lấy chi tiết theo id
+    match = get_character_index().best_match(name)
+    if match:
+        info = get_character_by_id(match['mal_id'])
+        if info: return info
     results = get_character_data(name)
     return results[0] if results else None
 
-def get_random_manga_data():
-    url = "https://api.jikan.moe/v4/random/manga"
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json().get('data', {})
-            # Filter explicit content
-            for genre in data.get('genres', []):
-                if genre['name'] in ['Hentai', 'Erotica', 'Harem']:
-                    return get_random_manga_data()
-            return data
+def search_by_genres(content_type, genre_ids, order_by, sort, page=1, limit=10):
+    """Một trang kết quả: trả về (items, has_next_page), hoặc None nếu lỗi"""
+    params = {
+        'genres': ",".join(str(g) for g in genre_ids),
+        'order_by': order_by, 'sort': sort, 'page': page, 'limit': limit
+    }
+    payload = get_client().get(content_type, params=params)
+    if payload is None: return None
+    has_next = payload.get('pagination', {}).get('has_next_page', False)
+    return payload.get('data', []), has_next
+
+def search_media_by_title(content_type, title):
+    """
+    Entry Jikan khớp nhất với tên (gọi được từ worker thread - cache ở tầng client).
+    None = không có kết quả; Jikan lỗi thì raise JikanUnavailable để caller không ghi nhớ là "không khớp".
+    """
+    payload = get_client().get(content_type.lower(), params={'q': title, 'limit': 1})
+    if payload is None: raise JikanUnavailable(content_type.lower())
+    data = payload.get('data', [])
+    return data[0] if data else None
+
+def enrich_titles(content_type, titles, max_workers=3):
+    """Tra song song các tên trên Jikan; trả về {future: title} để caller render theo thứ tự xong"""
+    executor = get_executor("enrich", max_workers=max_workers)
+    return {executor.submit(search_media_by_title, content_type, t): t for t in titles}
+
+# --- PREFETCH trang kế tiếp ---
+_prefetches = OrderedDict()  # (args) -> (created_at, Future), cũ nhất đứng đầu
+_prefetch_lock = threading.Lock()
+MAX_PREFETCHES = 64
+
+def _expire_prefetches(now):
+    """Bỏ trang prefetch cũ hơn GENRE_CACHE_TTL - kết quả Jikan đã có thể đổi (gọi khi giữ lock)"""
+    while _prefetches:
+        created, _ = next(iter(_prefetches.values()))
+        if now - created < GENRE_CACHE_TTL: break
+        _prefetches.popitem(last=False)
+
+def prefetch_genre_page(content_type, genre_ids, order_by, sort, page, limit=10):
+    """Fetch trước trang `page` trên worker thread trong lúc trang hiện tại đang render"""
+    key = (content_type, tuple(genre_ids), order_by, sort, page, limit)
+    now = time.monotonic()
+    with _prefetch_lock:
+        _expire_prefetches(now)
+        if key in _prefetches: return
+        _prefetches[key] = now, get_executor("prefetch").submit(
+            search_by_genres, content_type, genre_ids, order_by, sort, page, limit)
+        while len(_prefetches) > MAX_PREFETCHES:
+            _prefetches.popitem(last=False)
+
+def get_genre_page(content_type, genre_ids, order_by, sort, page, limit=10):
+    """Lấy kết quả đã prefetch nếu có, nếu không thì fetch trực tiếp"""
+    key = (content_type, tuple(genre_ids), order_by, sort, page, limit)
+    with _prefetch_lock:
+        _expire_prefetches(time.monotonic())
+        _, future = _prefetches.pop(key, (None, None))
+    cache_result("genre_prefetch", future is not None)
+    if future is not None:
+        result = future.result()
+        if result is not None: return result
+    return search_by_genres(content_type, genre_ids, order_by, sort, page, limit)
+
+# --- MANGA OF THE DAY ---
+EXPLICIT_GENRES = {'Hentai', 'Erotica', 'Harem'}
+
+def is_safe_manga(data):
+    return not any(g['name'] in EXPLICIT_GENRES for g in data.get('genres', []))
+
+def get_random_manga_data(max_attempts=5, background=False):
+    """Random manga đã lọc explicit - blocking, tối đa max_attempts lần gọi"""
+    for _ in range(max_attempts):
+        payload = get_client().get("random/manga", background=background)
+        if payload is None: return None
+        data = payload.get('data', {})
+        if data and is_safe_manga(data): return data
+    return None
+
+def pick_manga_of_the_day(day):
+    """Chọn từ top manga theo ngày - mọi replica cùng ra một kết quả"""
+    seed = day.toordinal()
+    payload = get_client().get("top/manga", params={'page': seed % 4 + 1, 'limit': 25})
+    if payload is None: return None
+    candidates = [m for m in payload.get('data', []) if is_safe_manga(m)]
+    return candidates[seed % len(candidates)] if candidates else None
+
+class RandomMangaPool:
+    """Pool random manga đã lọc, worker nền giữ pool luôn đầy; take() không bao giờ chờ network"""
+
+    def __init__(self, target_size=6, low_water=2):
+        self.target_size = target_size
+        self.low_water = low_water
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._filling = False
+        self._day = None
+        self._of_the_day = None
+        self._picking_day = None
+        self._picked = threading.Event()  # set khi lần chọn manga of the day đang chạy xong
+
+    def take(self):
+        with self._lock:
+            item = self._items.popleft() if self._items else None
+            low = len(self._items) < self.low_water
+        cache_result("manga_pool", item is not None)
+        if low: self.refill()
+        return item
+
+    def refill(self):
+        with self._lock:
+            if self._filling: return
+            self._filling = True
+        get_executor("manga-pool", max_workers=2).submit(self._fill)
+
+    def _fill(self):
+        try:
+            while len(self._items) < self.target_size:
+                # Chỉ dùng slot rate limit rảnh → không bắt search của user chờ sau refill
+                item = get_random_manga_data(background=True)
+                if item is None: break
+                with self._lock:
+                    if all(i.get('mal_id') != item.get('mal_id') for i in self._items):
+                        self._items.append(item)
+        finally:
+            with self._lock:
+                self._filling = False
+
+    def of_the_day(self, wait=0):
+        """
+        Manga of the day (tính một lần mỗi ngày cho mọi người), None nếu chưa sẵn sàng.
+        wait: số giây tối đa chờ lần chọn đang chạy (request đầu tiên trong ngày).
+        """
+        today = date.today()
+        with self._lock:
+            if self._day == today: return self._of_the_day
+            picked = self._picked
+            if self._picking_day != today:
+                self._picking_day = today
+                picked = self._picked = threading.Event()
+                get_executor("manga-pool", max_workers=2).submit(self._pick_of_the_day, today, picked)
+        if wait and picked.wait(wait):
+            with self._lock:
+                if self._day == today: return self._of_the_day
         return None
-    except: return None
\ No newline at end of file
+
+    def _pick_of_the_day(self, day, picked):
+        item = None
+        try:
+            item = pick_manga_of_the_day(day)
+        finally:
+            with self._lock:
+                if item is not None:
+                    self._day, self._of_the_day = day, item
+                self._picking_day = None
+            picked.set()
+
+_manga_pool = None
+_manga_pool_lock = threading.Lock()
+
+def get_manga_pool():
+    """Process-wide RandomMangaPool, bắt đầu fill ngay lần gọi đầu tiên"""
+    global _manga_pool
+    with _manga_pool_lock:
+        if _manga_pool is None:
+            _manga_pool = RandomMangaPool()
+            _manga_pool.refill()
+            REGISTRY.register_collector(
+                lambda: [("itook_manga_pool_size", {}, len(_manga_pool._items))])
+        return _manga_pool
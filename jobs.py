@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import CancelledError
+
+from metrics import REGISTRY
+from workers import get_executor
+
+log = logging.getLogger(__name__)
+
+# --- BACKGROUND JOBS ---
+# Việc AI (recommendation, profile, vision) chạy trên worker pool của process
+# thay vì script thread: chờ quota / backoff 429 không làm đơ trang, user vẫn
+# chuyển trang được. UI giữ Job handle trong session_state và poll bằng
+# @st.fragment(run_every=...); code chạy trong job báo tiến độ qua current_job().
+
+JOB_WORKERS = 4
+KEEP_FINISHED = 15 * 60  # giữ job đã xong trong registry để trang admin xem
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINAL = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(CancelledError):
+    """Job bị huỷ; là CancelledError nên follower của SingleFlight sẽ tự chạy lại"""
+
+
+class Job:
+    def __init__(self, kind, label=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.label = label or kind
+        self.status = QUEUED
+        self.message = None  # dòng trạng thái cho UI ("Waiting for quota...")
+        self.level = "info"  # info | warning | error
+        self.partial = ""  # text đã stream được (profile)
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._eta_at = None
+        self._cancel = threading.Event()
+        self._future = None
+
+    @property
+    def done(self):
+        return self.status in FINAL
+
+    @property
+    def eta(self):
+        """Giây còn lại ước lượng, hoặc None nếu không biết"""
+        if self._eta_at is None or self.done:
+            return None
+        return max(0.0, self._eta_at - time.monotonic())
+
+    @property
+    def cancel_event(self):
+        return self._cancel
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+        if self._future is not None and self._future.cancel():
+            # Chưa kịp chạy → huỷ luôn
+            self._finish(CANCELLED)
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def report(self, message, eta=None, level="info"):
+        self.message = message
+        self.level = level
+        self._eta_at = time.monotonic() + eta if eta is not None else None
+
+    def append(self, text):
+        self.partial += text
+
+    def _finish(self, status):
+        self.status = status
+        self.finished_at = time.time()
+        self._eta_at = None
+
+
+_local = threading.local()
+
+
+def current_job():
+    """Job đang chạy trên thread hiện tại, hoặc None (script thread của Streamlit)"""
+    return getattr(_local, "job", None)
+
+
+def _run(job, func, args, kwargs):
+    _local.job = job
+    job.status = RUNNING
+    try:
+        job.check_cancelled()
+        result = func(*args, **kwargs)
+        job.check_cancelled()
+        job.result = result
+        job._finish(DONE)
+    except CancelledError:
+        log.debug("%s %s cancelled", job.kind, job.id)
+        job._finish(CANCELLED)
+    except Exception as e:
+        log.warning("%s %s failed: %s: %s", job.kind, job.id, type(e).__name__, e)
+        job.error = e
+        job.report(f"❌ {str(e)[:150]}", level="error")
+        job._finish(FAILED)
+    finally:
+        _local.job = None
+
+
+_jobs = OrderedDict()  # id -> Job
+_jobs_lock = threading.Lock()
+
+
+def submit_job(kind, func, *args, label=None, pool="ai-jobs", **kwargs):
+    """
+    Chạy func(*args, **kwargs) trên worker pool AI, trả về Job handle ngay.
+    pool: việc hàng loạt (vd. nhiều ảnh vision) dùng pool riêng để không chiếm hết chỗ của việc khác.
+    """
+    job = Job(kind, label)
+    with _jobs_lock:
+        _prune(time.time())
+        _jobs[job.id] = job
+    job._future = get_executor(pool, max_workers=JOB_WORKERS).submit(_run, job, func, args, kwargs)
+    return job
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def _prune(now):
+    for job_id in [j.id for j in _jobs.values() if j.done and now - j.finished_at > KEEP_FINISHED]:
+        del _jobs[job_id]
+
+
+def collect_stream(chunks):
+    """Gom một generator text vào job hiện tại (job.partial) để UI hiện dần; trả về toàn bộ text"""
+    job = current_job()
+    pieces = []
+    try:
+        for piece in chunks:
+            if job is not None:
+                job.check_cancelled()
+                job.append(piece)
+            pieces.append(piece)
+    finally:
+        # Huỷ giữa chừng → đóng generator để nó giải phóng single-flight
+        chunks.close()
+    return "".join(pieces)
+
+
+def _job_samples():
+    with _jobs_lock:
+        counts = Counter((j.kind, j.status) for j in _jobs.values())
+    return [("itook_jobs", {"kind": kind, "status": status}, n) for (kind, status), n in counts.items()]
+
+
+REGISTRY.register_collector(_job_samples)
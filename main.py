@@ -1,16 +1,28 @@
 import streamlit as st
 import google.generativeai as genai
-import requests
 import json
 import re
 import os
-import time
+import hmac
+import uuid
+from collections import OrderedDict
+from concurrent.futures import as_completed
 from datetime import datetime
+from io import BytesIO
 
 # --- IMPORT MODULES ---
 from style_css import set_global_style
-from jikan_services import get_genre_map, get_character_data, get_one_character_data, get_random_manga_data
+from jikan_services import get_genre_map, get_character_data, get_character_by_id, get_one_character_data, get_manga_pool, get_genre_page, prefetch_genre_page, enrich_titles, JikanUnavailable
 from ai_service import ai_vision_detect, generate_ai_stream, get_ai_recommendations
+from jobs import CANCELLED, DONE, FAILED, QUEUED, collect_stream, submit_job
+from character_index import get_character_index
+from favorites_store import FavoritesStore
+from image_cache import SIZES, make_thumbnail, thumbnail
+from warmup import start_warmup
+from metrics import REGISTRY, METRICS_FILE, WRITE_INTERVAL, cache_summary, external_summary, start_metrics_writer
+from model_router import hedge_summary, router_summary
+from prompts import get_token_ledger
+from history import SessionHistory, get_access_model, prefetch_after_character, prefetch_favourite_genres
 
 # --- 1. PAGE CONFIG & SETUP ---
 st.set_page_config(page_title="ITOOK Library", layout="wide", page_icon="📚")
@@ -26,6 +38,11 @@ else:
 
 genai.configure(api_key=API_KEY)
 
+# Warmup chạy nền một lần mỗi process - không chặn lần render này
+start_warmup()
+# Metrics ghi ra file Prometheus định kỳ (ITOOK_METRICS_FILE)
+start_metrics_writer()
+
 # --- 2. GLOBAL CSS & LOADING SCREEN ---
 st.markdown("""
 <style>
@@ -55,31 +72,64 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- 3. SESSION STATE INITIALIZATION ---
+def get_user_id():
+    """Id ẩn danh giữ trong URL (?uid=...) để favorites còn khi mở lại trang"""
+    uid = st.query_params.get("uid")
+    if not uid:
+        uid = uuid.uuid4().hex
+        st.query_params["uid"] = uid
+    return uid
+
+
+def is_admin():
+    """Trang admin chỉ mở được qua ?admin=<ADMIN_TOKEN> (secrets hoặc env)"""
+    token = st.secrets["ADMIN_TOKEN"] if "ADMIN_TOKEN" in st.secrets else os.environ.get("ADMIN_TOKEN")
+    given = st.query_params.get("admin")
+    return bool(token and given) and hmac.compare_digest(str(given), str(token))
+
+
 if 'current_page' not in st.session_state:
-    st.session_state.current_page = 'home'
+    st.session_state.current_page = 'admin' if is_admin() else 'home'
 
 if 'show_upgrade_modal' not in st.session_state:
     st.session_state.show_upgrade_modal = False
 
 if 'favorites' not in st.session_state:
-    st.session_state.favorites = {'media': [], 'characters': []}
+    st.session_state.favorites = FavoritesStore(get_user_id())
 
 if 'search_history' not in st.session_state:
-    st.session_state.search_history = []
+    st.session_state.search_history = SessionHistory()
 
 if 'random_manga_item' not in st.session_state:
     st.session_state.random_manga_item = None
+    st.session_state.random_manga_daily = False  # item là manga of the day thật hay chỉ là random
 
 if 'recommendations' not in st.session_state:
     st.session_state.recommendations = None
 
+if 'recommendation_media' not in st.session_state:
+    st.session_state.recommendation_media = {}  # title -> Jikan entry (None nếu không tìm thấy)
+
+if 'jobs' not in st.session_state:
+    st.session_state.jobs = {}  # key -> Job (việc AI đang chạy nền của session này)
+
+if 'vision_results' not in st.session_state:
+    st.session_state.vision_results = []  # mỗi ảnh đã upload: thumbnail + kết quả nhận diện
+    st.session_state.vision_batch = []  # file_id của lô ảnh đã gửi nhận diện
+
+if 'genre_results' not in st.session_state:
+    # query -> {'items', 'page', 'has_next', 'error'}; giữ vài query gần nhất trong session
+    st.session_state.genre_results = OrderedDict()
+    st.session_state.genre_query = None
+
 # *** KEY FIX: Dùng session_state để cache kết quả như code mới ***
 if 'wiki_state' not in st.session_state:
     st.session_state.wiki_state = {
         'search_results': [],
         'selected_char': None,
         'ai_analysis': None,  # ← LƯU KẾT QUẢ AI Ở ĐÂY
-        'mode': None
+        'mode': None,
+        'from_index': False  # kết quả search đến từ index local (có nút hỏi Jikan)
     }
 
 # --- 4. HELPER FUNCTIONS ---
@@ -89,30 +139,26 @@ def navigate_to(page):
     st.rerun()
 
 def add_to_history(action_type, query, details=None):
-    entry = {
-        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'type': action_type, 'query': query, 'details': details
-    }
-    st.session_state.search_history.insert(0, entry)
-    if len(st.session_state.search_history) > 50:
-        st.session_state.search_history = st.session_state.search_history[:50]
+    st.session_state.search_history.add(action_type, query, details)
+
+def record_character_view(char):
+    """Ghi lịch sử + chuyển tiếp X → Y cho mô hình truy cập, rồi prefetch nhân vật hay được xem tiếp"""
+    prev = st.session_state.search_history.last('character')
+    get_access_model().record_transition(prev['details'] if prev else None, char['mal_id'], char.get('name'))
+    add_to_history('character', char.get('name'), char['mal_id'])
+    prefetch_after_character(char['mal_id'])
 
 def is_favorited(item_id, category):
-    for item in st.session_state.favorites[category]:
-        current_id = item.get('mal_id') or item.get('id')
-        if str(current_id) == str(item_id): return True
-    return False
+    return st.session_state.favorites.contains(category, item_id)
 
-def toggle_favorite(data, category='media'):
+def toggle_favorite(data, category='media', notify=True):
+    """Thêm / bỏ yêu thích; trả về (message, icon) của toast"""
     item_id = data.get('mal_id') or data.get('id')
     title_name = data.get('title') or data.get('name') or data.get('title_english')
     
     if is_favorited(item_id, category):
-        st.session_state.favorites[category] = [
-            i for i in st.session_state.favorites[category] 
-            if str(i.get('mal_id') or i.get('id')) != str(item_id)
-        ]
-        st.toast(f"💔 Removed '{title_name}'", icon="🗑️")
+        st.session_state.favorites.remove(category, item_id)
+        toast = (f"💔 Removed '{title_name}'", "🗑️")
     else:
         fav_item = {
             'mal_id': item_id,
@@ -121,10 +167,158 @@ def toggle_favorite(data, category='media'):
             'score': data.get('score'),
             'url': data.get('url'),
             'type': category,
+            'media_type': data.get('type'),
             'added_at': datetime.now().strftime("%Y-%m-%d")
         }
-        st.session_state.favorites[category].append(fav_item)
-        st.toast(f"❤️ Added '{title_name}'", icon="✅")
+        st.session_state.favorites.add(category, fav_item)
+        toast = (f"❤️ Added '{title_name}'", "✅")
+    if notify: st.toast(toast[0], icon=toast[1])
+    return toast
+
+def _on_favorite_click(data, category, key):
+    # Callback không được vẽ element khi fragment rerun → để toast cho thân fragment
+    st.session_state[f"{key}_toast"] = toggle_favorite(data, category, notify=False)
+
+@st.fragment
+def favorite_button(data, category, key, labels=("❤️", "💔"), **kwargs):
+    """Nút yêu thích trong fragment: bấm chỉ rerun chính nút này, không dựng lại cả trang"""
+    # on_click chạy trước khi fragment rerun → nhãn đúng ngay, không cần st.rerun()
+    fav = is_favorited(data.get('mal_id'), category)
+    st.button(labels[1] if fav else labels[0], key=key, on_click=_on_favorite_click,
+              args=(data, category, key), **kwargs)
+    toast = st.session_state.pop(f"{key}_toast", None)
+    if toast: st.toast(toast[0], icon=toast[1])
+
+# --- AI JOBS ---
+def start_job(key, kind, func, *args, label=None, pool="ai-jobs"):
+    """Gửi việc AI sang worker pool; handle giữ trong session_state.jobs[key]"""
+    st.session_state.jobs[key] = submit_job(kind, func, *args, label=label, pool=pool)
+
+def take_finished_job(key):
+    """Job đã xong → lấy khỏi session để trang xử lý kết quả; chưa xong → None"""
+    job = st.session_state.jobs.get(key)
+    if job is not None and job.done:
+        return st.session_state.jobs.pop(key)
+    return None
+
+@st.fragment(run_every="0.5s")
+def job_progress(key, show_partial=False):
+    """Trạng thái / ETA / nút huỷ của job; xong thì rerun cả trang để nhận kết quả"""
+    job = st.session_state.jobs.get(key)
+    if job is None: return
+    if job.done: st.rerun()
+    with st.container(border=True):
+        c1, c2 = st.columns([5, 1], vertical_alignment="center")
+        with c1:
+            text = job.message or ("⏳ Queued..." if job.status == QUEUED else f"🤖 {job.label}...")
+            eta = job.eta
+            if eta: text += f" (~{eta:.0f}s)"
+            if job.level == "warning": st.warning(text)
+            else: st.caption(text)
+        with c2:
+            if st.button("✖ Cancel", key=f"cancel_{job.id}", use_container_width=True):
+                # Bỏ job khỏi session ngay; worker tự dừng ở lần kiểm tra kế tiếp
+                job.cancel()
+                st.session_state.jobs.pop(key, None)
+                st.rerun()
+        if show_partial and job.partial: st.markdown(job.partial)
+
+def identify_character(image_bytes):
+    """Chạy trong job: nhận diện ảnh rồi tra Jikan; trả về (name, info)"""
+    name = ai_vision_detect(BytesIO(image_bytes))
+    if name == "Unknown": return name, None
+    return name, get_one_character_data(name)
+
+# --- VISION BATCH ---
+# Mỗi ảnh là một job trên pool riêng: nhận diện chạy song song (scheduler vẫn
+# giữ quota Gemini), ảnh nào xong thì tra Jikan ngay trong job đó → kết quả
+# hiện dần theo từng ảnh thay vì chờ cả lô.
+MAX_VISION_IMAGES = 8
+VISION_POOL = "vision-jobs"
+
+def vision_job_keys():
+    return [k for k in st.session_state.jobs if k.startswith("vision:")]
+
+def select_character(info):
+    st.session_state.wiki_state['selected_char'] = info
+    st.session_state.wiki_state['ai_analysis'] = None
+    record_character_view(info)
+
+def cancel_vision_batch():
+    """Huỷ job vision còn chạy của lô cũ và bỏ kết quả của nó"""
+    for key in vision_job_keys():
+        st.session_state.jobs.pop(key).cancel()
+    st.session_state.vision_results = []
+    st.session_state.vision_batch = []
+
+def start_vision_batch(files):
+    """Huỷ lô cũ còn chạy, gửi mỗi ảnh (tối đa MAX_VISION_IMAGES) thành một job vision"""
+    cancel_vision_batch()
+    st.session_state.vision_batch = [f.file_id for f in files]
+    for i, f in enumerate(files[:MAX_VISION_IMAGES]):
+        data = f.getvalue()
+        try: thumb = make_thumbnail(data, SIZES['grid'])
+        except OSError: thumb = None
+        st.session_state.vision_results.append({'file': f.name, 'thumb': thumb, 'name': None, 'info': None, 'error': None})
+        start_job(f"vision:{i}", 'vision', identify_character, data, label=f"Scanning {f.name}", pool=VISION_POOL)
+
+def collect_vision_results():
+    """Job vision đã xong → ghi kết quả vào vision_results; nhân vật đầu tiên tìm được thì mở profile"""
+    for key in vision_job_keys():
+        job = take_finished_job(key)
+        if job is None: continue
+        entry = st.session_state.vision_results[int(key.split(":")[1])]
+        if job.status == DONE:
+            entry['name'], entry['info'] = job.result
+            add_to_history('vision', entry['name'])
+            if entry['info'] and not st.session_state.wiki_state['selected_char']:
+                select_character(entry['info'])
+        else:
+            entry['error'] = job.message or "❌ Cannot identify character"
+
+def show_vision_results():
+    n_cols = 4
+    results = st.session_state.vision_results
+    for start in range(0, len(results), n_cols):
+        cols = st.columns(n_cols)
+        for i, entry in enumerate(results[start:start + n_cols], start):
+            with cols[i - start]:
+                if entry['thumb']: st.image(entry['thumb'], use_container_width=True)
+                job = st.session_state.jobs.get(f"vision:{i}")
+                info = entry['info']
+                if job is not None:
+                    text = job.message or ("⏳ Queued..." if job.status == QUEUED else "🔍 Scanning...")
+                    if job.eta: text += f" (~{job.eta:.0f}s)"
+                    st.caption(text)
+                elif info:
+                    st.markdown(f"🎯 **{entry['name']}**")
+                    selected = st.session_state.wiki_state['selected_char']
+                    if selected and selected['mal_id'] == info['mal_id']:
+                        st.caption("✅ Showing below")
+                    elif st.button("📖 View profile", key=f"vision_view_{i}", use_container_width=True):
+                        select_character(info)
+                        st.rerun()
+                elif entry['error']:
+                    st.caption(entry['error'])
+                elif entry['name'] and entry['name'] != "Unknown":
+                    st.caption(f"❌ No database match for **{entry['name']}**")
+                else:
+                    st.caption("❌ Cannot identify character")
+
+@st.fragment(run_every="0.5s")
+def vision_progress():
+    """Poll các job vision: ảnh nào xong hiện kết quả ngay; hết job thì rerun cả trang"""
+    had_profile = st.session_state.wiki_state['selected_char'] is not None
+    collect_vision_results()
+    pending = vision_job_keys()
+    # Vừa tìm được nhân vật đầu tiên → rerun cả trang để profile hiện ngay, không chờ cả lô
+    if not pending or (not had_profile and st.session_state.wiki_state['selected_char']): st.rerun()
+    show_vision_results()
+    if st.button(f"✖ Cancel ({len(pending)} left)", key="vision_cancel"):
+        for key in pending:
+            st.session_state.jobs.pop(key).cancel()
+            st.session_state.vision_results[int(key.split(":")[1])]['error'] = "✖ Cancelled"
+        st.rerun()
 
 # --- 5. UI COMPONENTS ---
 def show_navbar():
@@ -178,20 +372,28 @@ def show_homepage():
     with c3: 
         if st.button("🤖 AI RECOMMENDATION", use_container_width=True): navigate_to('recommend')
 
+    pool = get_manga_pool()
     if not st.session_state.random_manga_item:
-        st.session_state.random_manga_item = get_random_manga_data()
+        # Request đầu tiên trong ngày chờ chút cho lần chọn; chưa xong thì hiện manga random, đúng nhãn
+        set_random_manga(pool.of_the_day(wait=OF_THE_DAY_WAIT), pool)
     
     manga = st.session_state.random_manga_item
+    if not manga: show_manga_loading()
     if manga:
+        title = "✨ Manga of the Day" if st.session_state.random_manga_daily else "🎲 Random Manga"
         st.markdown("---")
-        st.markdown('<h3 style="text-align:center; color: #ffd700;">✨ Manga of the Day</h3>', unsafe_allow_html=True)
+        st.markdown(f'<h3 style="text-align:center; color: #ffd700;">{title}</h3>', unsafe_allow_html=True)
         with st.container(border=True):
             col_img, col_info = st.columns([1, 3], gap="large")
             with col_img:
-                st.image(manga.get('images', {}).get('jpg', {}).get('large_image_url'), use_container_width=True)
+                st.image(thumbnail(manga.get('images', {}).get('jpg', {}).get('large_image_url'), 'hero'), use_container_width=True)
                 if st.button("🔄 Shuffle New", use_container_width=True):
-                    st.session_state.random_manga_item = get_random_manga_data()
-                    st.rerun()
+                    item = pool.take()
+                    if item:
+                        st.session_state.random_manga_item = item
+                        st.session_state.random_manga_daily = False
+                        st.rerun()
+                    else: st.toast("⏳ Fetching more manga, try again in a moment.")
             with col_info:
                 st.markdown(f"## {manga.get('title_english') or manga.get('title')}")
                 st.markdown(f"**⭐ Score:** {manga.get('score')} | **Status:** {manga.get('status')}")
@@ -199,6 +401,23 @@ def show_homepage():
                 if synopsis and len(synopsis) > 600: synopsis = synopsis[:600] + "..."
                 st.write(synopsis)
 
+OF_THE_DAY_WAIT = 1.5  # giây chờ lần chọn manga of the day ở request đầu tiên
+
+def set_random_manga(daily, pool):
+    """Manga of the day nếu đã chọn xong, không thì một manga random từ pool; trả về item"""
+    item = daily or pool.take()
+    st.session_state.random_manga_item = item
+    st.session_state.random_manga_daily = daily is not None
+    return item
+
+@st.fragment(run_every="2s")
+def show_manga_loading():
+    """Pool chưa có manga (server vừa khởi động) → poll nhẹ, không chặn render"""
+    pool = get_manga_pool()
+    if set_random_manga(pool.of_the_day(), pool):
+        st.rerun()
+    st.caption("✨ Manga of the Day is loading...")
+
 def show_recommend_page():
     set_global_style("test1.jpg")
     show_navbar()
@@ -220,20 +439,64 @@ def show_recommend_page():
             submit = st.form_submit_button("✨ Generate", type="primary", use_container_width=True)
             
         if submit and interests:
-            with st.spinner("🤖 AI is thinking..."):
-                recs = get_ai_recommendations(age, interests, mood, style, ctype)
-                if recs:
-                    st.session_state.recommendations = recs
-                    st.rerun()
-                else:
-                    st.error("AI is busy. Please try again in 2 minutes.")
+            add_to_history('recommend', interests, {'age': age, 'mood': mood, 'style': style, 'type': ctype})
+            start_job('recommend', 'recommend', get_ai_recommendations, age, interests, mood, style, ctype,
+                      label="AI is thinking")
+            st.session_state.recommendation_pending_type = ctype
+
+        job = take_finished_job('recommend')
+        if job and job.status == DONE and job.result:
+            st.session_state.recommendations = job.result
+            st.session_state.recommendation_type = st.session_state.recommendation_pending_type
+            st.session_state.recommendation_media = {}
+        elif job and job.status != CANCELLED:
+            st.error(job.message if job.level == "error" else "AI is busy. Please try again in 2 minutes.")
+        if 'recommend' in st.session_state.jobs:
+            job_progress('recommend')
 
     if st.session_state.recommendations:
         st.markdown("### 🎯 Recommendations:")
+        media = st.session_state.recommendation_media
+        slots = []  # theo vị trí: hai recommendation trùng tên vẫn có slot riêng
         for i, item in enumerate(st.session_state.recommendations):
             with st.container(border=True):
-                st.markdown(f"**#{i+1} {item['title']}** ({item.get('genre','')})")
-                st.info(item['reason'])
+                c1, c2 = st.columns([1, 4])
+                with c2:
+                    st.markdown(f"**#{i+1} {item['title']}** ({item.get('genre','')})")
+                    st.info(item['reason'])
+                with c1:
+                    slots.append((item['title'], st.empty()))
+
+        # Tra Jikan song song, card nào xong trước hiện trước
+        pending = list(dict.fromkeys(t for t, _ in slots if t not in media))
+        for i, (t, slot) in enumerate(slots):
+            if t in media: render_media_slot(slot, media[t], i)
+            else: slot.caption("🔎 Looking up...")
+        if pending:
+            futures = enrich_titles(st.session_state.get('recommendation_type', 'Anime'), pending)
+            for future in as_completed(futures):
+                title = futures[future]
+                entry, failed = None, False
+                try:
+                    # Chỉ ghi nhớ kết quả thật (kể cả "không khớp"); Jikan lỗi thì lần render sau tra lại
+                    entry = media[title] = future.result()
+                except JikanUnavailable:
+                    failed = True
+                for i, (t, slot) in enumerate(slots):
+                    if t == title: render_media_slot(slot, entry, i, failed)
+
+def render_media_slot(slot, entry, index, failed=False):
+    """Ảnh bìa, điểm, link MAL và nút yêu thích cho một recommendation"""
+    with slot.container():
+        if failed:
+            st.caption("⚠️ MyAnimeList lookup failed.")
+            return
+        if not entry:
+            st.caption("No MyAnimeList match.")
+            return
+        st.image(thumbnail(entry['images']['jpg']['image_url'], 'card'), use_container_width=True)
+        st.caption(f"⭐ {entry.get('score') or 'N/A'} · [MAL #{entry['mal_id']}]({entry.get('url')})")
+        favorite_button(entry, 'media', key=f"r_{index}_{entry['mal_id']}")
 
 def show_genre_page():
     set_global_style("test4.jpg")
@@ -241,6 +504,10 @@ def show_genre_page():
     if st.session_state.show_upgrade_modal: show_upgrade_dialog()
     
     st.title("📂 Genre Explorer")
+    if not st.session_state.get('genre_prefetched'):
+        # Query user hay chọn nhất → fetch sẵn trong lúc họ chọn genre
+        prefetch_favourite_genres(get_user_id())
+        st.session_state.genre_prefetched = True
     col1, col2 = st.columns(2)
     with col1: ctype = st.selectbox("Type:", ["anime", "manga"])
     with col2: sort_by = st.selectbox("Sort:", ["Popularity", "Newest", "Oldest"])
@@ -251,31 +518,73 @@ def show_genre_page():
         if st.button("🔍 Search", type="primary"):
             if not selected: st.warning("Pick a genre!")
             else:
-                ids = ",".join([str(genre_map[n]) for n in selected])
+                ids = [genre_map[n] for n in selected]
                 order = "score" if sort_by == "Popularity" else "start_date"
                 sort = "desc" if sort_by != "Oldest" else "asc"
-                
-                url = f"https://api.jikan.moe/v4/{ctype}?genres={ids}&order_by={order}&sort={sort}&limit=10"
-                with st.spinner("Fetching..."):
-                    try:
-                        r = requests.get(url).json()
-                        data = r.get('data', [])
-                        if data:
-                            for item in data:
-                                with st.container(border=True):
-                                    c1, c2 = st.columns([1, 4])
-                                    with c1: st.image(item['images']['jpg']['image_url'], use_container_width=True)
-                                    with c2:
-                                        st.subheader(item.get('title_english') or item.get('title'))
-                                        st.write(item.get('synopsis', '')[:200] + "...")
-                                        
-                                        mid = item.get('mal_id')
-                                        fav = is_favorited(mid, 'media')
-                                        if st.button("💔" if fav else "❤️", key=f"g_{mid}"):
-                                            toggle_favorite(item, 'media')
-                                            st.rerun()
-                        else: st.warning("No results.")
-                    except: st.error("Error fetching data.")
+                query = (ctype, tuple(ids), order, sort)
+                add_to_history('genre', ", ".join(selected), query)
+                get_access_model().record_genre_query(get_user_id(), query)
+                st.session_state.genre_query = query
+                if not genre_results_for(query)['items']:
+                    with st.spinner("Fetching..."):
+                        load_genre_page(query, 1)
+    else:
+        st.warning("Could not load genres from MyAnimeList. Please try again in a moment.")
+
+    query = st.session_state.genre_query
+    if query is None: return
+    gs = genre_results_for(query)
+    if gs.get('error'): st.error("Error fetching data.")
+    if not gs['items']:
+        if not gs.get('error'): st.warning("No results.")
+        return
+
+    st.caption(f"Page {gs['page']} · {len(gs['items'])} titles")
+    for item in gs['items']:
+        genre_result_card(item)
+
+    if gs['has_next']:
+        if st.button(f"⬇️ Load more (page {gs['page'] + 1})", use_container_width=True):
+            with st.spinner("Fetching..."):
+                load_genre_page(query, gs['page'] + 1)
+            st.rerun()
+
+@st.fragment
+def genre_result_card(item):
+    """Một kết quả genre; bấm ❤️ chỉ rerun card này (dữ liệu lấy từ genre_results, không gọi mạng)"""
+    with st.container(border=True):
+        c1, c2 = st.columns([1, 4])
+        with c1: st.image(thumbnail(item['images']['jpg']['image_url'], 'card'), use_container_width=True)
+        with c2:
+            st.subheader(item.get('title_english') or item.get('title'))
+            st.write((item.get('synopsis') or '')[:200] + "...")
+            favorite_button(item, 'media', key=f"g_{item.get('mal_id')}")
+
+MAX_GENRE_RESULTS = 5
+
+def genre_results_for(query):
+    """Entry kết quả của query trong session (tạo mới nếu chưa có, bỏ query cũ nhất khi quá nhiều)"""
+    results = st.session_state.genre_results
+    if query not in results:
+        results[query] = {'items': [], 'page': 0, 'has_next': False, 'error': False}
+        while len(results) > MAX_GENRE_RESULTS:
+            results.popitem(last=False)
+    results.move_to_end(query)
+    return results[query]
+
+def load_genre_page(query, page):
+    """Nối trang `page` vào kết quả của query và prefetch trang kế tiếp ở background"""
+    gs = genre_results_for(query)
+    result = get_genre_page(*query, page)
+    if result is None:
+        gs['error'] = True
+        return
+    items, has_next = result
+    seen = {i.get('mal_id') for i in gs['items']}
+    gs['items'].extend(i for i in items if i.get('mal_id') not in seen)
+    gs.update(page=page, has_next=has_next, error=False)
+    if has_next:
+        prefetch_genre_page(*query, page + 1)
 
 def show_favorites_page():
     set_global_style("test2.jpg")
@@ -285,32 +594,66 @@ def show_favorites_page():
     st.title("❤️ My Favorites")
     t1, t2 = st.tabs(["Media", "Characters"])
     
-    with t1:
-        items = st.session_state.favorites['media']
-        if not items: st.info("Empty.")
-        else:
-            cols = st.columns(3)
-            for i, item in enumerate(items):
-                with cols[i%3]:
-                    with st.container(border=True):
-                        if item.get('image_url'): st.image(item['image_url'])
-                        st.write(f"**{item.get('title')}**")
-                        if st.button("Remove", key=f"rm_m_{item['mal_id']}"):
-                            toggle_favorite(item, 'media')
-                            st.rerun()
-    with t2:
-        items = st.session_state.favorites['characters']
-        if not items: st.info("Empty.")
-        else:
-            cols = st.columns(4)
-            for i, item in enumerate(items):
-                with cols[i%4]:
-                    with st.container(border=True):
-                        if item.get('image_url'): st.image(item['image_url'])
-                        st.write(f"**{item.get('title')}**")
-                        if st.button("Remove", key=f"rm_c_{item['mal_id']}"):
-                            toggle_favorite(item, 'characters')
-                            st.rerun()
+    with t1: show_favorites_grid('media', n_cols=3, page_size=12)
+    with t2: show_favorites_grid('characters', n_cols=4, page_size=16)
+
+FAV_SORTS = {"Recently added": "recent", "Oldest added": "oldest", "Score": "score", "Title": "title"}
+
+def show_favorites_grid(category, n_cols, page_size):
+    """Lọc / sắp xếp trong store, chỉ dựng widget cho trang đang xem"""
+    store = st.session_state.favorites
+    if not store.count(category):
+        st.info("Empty.")
+        return
+
+    prefix = f"fav_{category}"
+    c1, c2, c3 = st.columns([2, 1, 1])
+    with c1: text = st.text_input("Filter:", key=f"{prefix}_text", placeholder="Title contains...")
+    with c2: sort = st.selectbox("Sort:", list(FAV_SORTS), key=f"{prefix}_sort")
+    kind = None
+    if category == 'media':
+        with c3: kind = st.selectbox("Type:", ["All"] + store.kinds(category), key=f"{prefix}_kind")
+        if kind == "All": kind = None
+
+    # Đổi bộ lọc → về trang 1
+    filters = (text, sort, kind)
+    if st.session_state.get(f"{prefix}_filters") != filters:
+        st.session_state[f"{prefix}_filters"] = filters
+        st.session_state[f"{prefix}_page"] = 0
+    page = st.session_state.get(f"{prefix}_page", 0)
+
+    items, total = store.query(category, text=text, kind=kind, sort=FAV_SORTS[sort],
+                               offset=page * page_size, limit=page_size)
+    n_pages = max(1, -(-total // page_size))
+    if not items and page > 0:
+        # Xoá hết item của trang cuối → lùi một trang
+        st.session_state[f"{prefix}_page"] = min(page, n_pages) - 1
+        st.rerun()
+    if not items:
+        st.info("No favorites match.")
+        return
+
+    cols = st.columns(n_cols)
+    for i, item in enumerate(items):
+        with cols[i % n_cols]:
+            with st.container(border=True):
+                if item.get('image_url'): st.image(thumbnail(item['image_url'], 'grid'))
+                st.write(f"**{item.get('title')}**")
+                if st.button("Remove", key=f"rm_{category[0]}_{item['mal_id']}"):
+                    toggle_favorite(item, category)
+                    st.rerun()
+
+    if n_pages > 1:
+        p1, p2, p3 = st.columns([1, 2, 1], vertical_alignment="center")
+        with p1:
+            if st.button("◀ Prev", key=f"{prefix}_prev", disabled=page == 0, use_container_width=True):
+                st.session_state[f"{prefix}_page"] = page - 1
+                st.rerun()
+        with p2: st.caption(f"Page {page + 1} / {n_pages} · {total} items")
+        with p3:
+            if st.button("Next ▶", key=f"{prefix}_next", disabled=page >= n_pages - 1, use_container_width=True):
+                st.session_state[f"{prefix}_page"] = page + 1
+                st.rerun()
 
 # --- 7. WIKI PAGE - FIX THEO LOGIC CODE MỚI ---
 def show_wiki_page():
@@ -326,7 +669,8 @@ def show_wiki_page():
             'search_results': [],
             'selected_char': None,
             'ai_analysis': None,
-            'mode': None
+            'mode': None,
+            'from_index': False
         }
 
     def render_profile():
@@ -341,12 +685,10 @@ def show_wiki_page():
         c1, c2 = st.columns([1, 2])
         
         with c1:
-            st.image(char['images']['jpg']['image_url'], use_container_width=True)
+            st.image(thumbnail(char['images']['jpg']['image_url'], 'profile'), use_container_width=True)
             cid = char['mal_id']
-            fav = is_favorited(cid, 'characters')
-            if st.button("💔 Unfavorite" if fav else "❤️ Favorite", key=f"w_fav_{cid}", use_container_width=True):
-                toggle_favorite(char, 'characters')
-                st.rerun()
+            favorite_button(char, 'characters', key=f"w_fav_{cid}",
+                            labels=("❤️ Favorite", "💔 Unfavorite"), use_container_width=True)
         
         with c2:
             st.header(char.get('name'))
@@ -354,27 +696,28 @@ def show_wiki_page():
             st.write(f"**Favorites:** {char.get('favorites', 0)}")
             
             # *** LOGIC GIỐNG CODE MỚI: Kiểm tra STATE trước ***
+            job_key = f"profile:{cid}"
+            job = take_finished_job(job_key)
+            if not ai_txt and job and job.status == DONE:
+                # *** KEY FIX: LƯU VÀO STATE như code mới ***
+                ai_txt = st.session_state.wiki_state['ai_analysis'] = job.result
+            elif job and job.status == FAILED:
+                st.error(job.message or "⚠️ Could not generate profile.")
+
             if ai_txt:
                 # Đã có trong state → hiển thị
                 st.success(ai_txt, icon="📝")
+            elif job_key in st.session_state.jobs:
+                # Đang viết ở worker → hiện từng đoạn đã stream về
+                job_progress(job_key, show_partial=True)
             else:
                 # Chưa có → hiện nút generate
                 st.info("✨ Want an AI-powered character analysis?")
                 
                 if st.button("🤖 Generate AI Profile", type="primary", key=f"gen_ai_{cid}"):
-                    with st.spinner("🤖 AI is writing..."):
-                        # Gọi hàm (đã có @st.cache_data trong ai_service.py)
-                        stream = generate_ai_stream(char)
-                        
-                        full_text = ""
-                        if stream:
-                            for chunk in stream:
-                                if hasattr(chunk, 'text'):
-                                    full_text += chunk.text
-                        
-                        # *** KEY FIX: LƯU VÀO STATE như code mới ***
-                        st.session_state.wiki_state['ai_analysis'] = full_text
-                        st.rerun()  # Rerun để hiển thị, nhưng lần sau sẽ lấy từ state
+                    start_job(job_key, 'profile', collect_stream, generate_ai_stream(char),
+                              label="Writing profile")
+                    st.rerun()
 
     # TABS
     t1, t2 = st.tabs(["🔤 Search Name", "📸 Vision Search"])
@@ -385,8 +728,27 @@ def show_wiki_page():
             if q:
                 reset_wiki()
                 st.session_state.wiki_state['mode'] = 'text'
-                with st.spinner("🔍 Searching..."):
-                    st.session_state.wiki_state['search_results'] = get_character_data(q)
+                add_to_history('search', q)
+                # Tên khớp / prefix trong index local → dùng luôn. Chỉ khớp gần đúng (trigram)
+                # thì hỏi Jikan trước; Jikan không có gì mới dùng gợi ý gần đúng của index
+                index = get_character_index()
+                suggestions = index.search(q, fuzzy=False)
+                st.session_state.wiki_state['from_index'] = bool(suggestions)
+                if not suggestions:
+                    with st.spinner("🔍 Searching..."):
+                        suggestions = get_character_data(q) or index.search(q)
+                st.session_state.wiki_state['search_results'] = suggestions
+
+        def on_search_jikan():
+            """Kết quả từ index không đúng người → hỏi thẳng Jikan"""
+            q = st.session_state.wiki_input
+            st.session_state.wiki_state['from_index'] = False
+            with st.spinner("🔍 Searching..."):
+                results = get_character_data(q)
+            if results:
+                st.session_state.wiki_state['search_results'] = results
+            else:
+                st.session_state.wiki_state['search_error'] = True
         
         st.text_input("Character Name:", key="wiki_input", on_change=on_search, placeholder="E.g. Naruto, Luffy...")
         
@@ -394,49 +756,61 @@ def show_wiki_page():
         if res:
             opts = {f"{c['name']} (ID: {c['mal_id']})": c for c in res}
             sel = st.selectbox("Select Character:", list(opts.keys()))
+            if st.session_state.wiki_state.get('from_index'):
+                st.button("🔎 Not listed? Search MyAnimeList", on_click=on_search_jikan)
+            if st.session_state.wiki_state.pop('search_error', None):
+                st.warning("No results from MyAnimeList right now.")
             
             chosen = opts[sel]
             current = st.session_state.wiki_state['selected_char']
             
             # Nếu chọn nhân vật MỚI → reset AI analysis
             if not current or current['mal_id'] != chosen['mal_id']:
+                # Gợi ý từ index chỉ có tên → lấy chi tiết nhân vật đã chọn từ Jikan
+                if 'about' not in chosen:
+                    with st.spinner("📖 Loading profile..."):
+                        chosen = get_character_by_id(chosen['mal_id'])
+                if not chosen:
+                    st.error("Error fetching data.")
+                    return
                 st.session_state.wiki_state['selected_char'] = chosen
                 st.session_state.wiki_state['ai_analysis'] = None
+                record_character_view(chosen)
             
             render_profile()
 
     with t2:
-        uploaded = st.file_uploader("Upload Anime Character Image", type=['jpg','png','jpeg'])
+        uploaded = st.file_uploader("Upload Anime Character Images", type=['jpg','png','jpeg'],
+                                    accept_multiple_files=True)
         
         if uploaded:
-            st.image(uploaded, width=200)
+            if len(uploaded) > MAX_VISION_IMAGES:
+                st.warning(f"Only the first {MAX_VISION_IMAGES} images will be scanned.")
+                uploaded = uploaded[:MAX_VISION_IMAGES]
+            # Lô ảnh khác lô đã nhận diện → chỉ hiện ảnh xem trước, chưa có kết quả
+            stale = [f.file_id for f in uploaded] != st.session_state.vision_batch
+            if stale:
+                # Đổi ảnh giữa chừng → job của lô cũ không còn ai xem, huỷ để khỏi tốn quota
+                if st.session_state.vision_batch: cancel_vision_batch()
+                st.image(uploaded, width=120)
             
-            if st.button("🔍 Identify Character", type="primary"):
+            label = "🔍 Identify Character" if len(uploaded) == 1 else f"🔍 Identify {len(uploaded)} Characters"
+            if st.button(label, type="primary"):
                 reset_wiki()
                 st.session_state.wiki_state['mode'] = 'image'
-                
-                with st.status("🔍 Scanning image...", expanded=True) as status:
-                    name = ai_vision_detect(uploaded)
-                    status.write(f"🎯 Detected: **{name}**")
-                    
-                    if name != "Unknown":
-                        time.sleep(1)
-                        info = get_one_character_data(name)
-                        if info:
-                            st.session_state.wiki_state['selected_char'] = info
-                            status.update(label="✅ Character Found!", state="complete", expanded=False)
-                        else:
-                            status.update(label="❌ No database match", state="error")
-                    else:
-                        status.update(label="❌ Cannot identify character", state="error")
-                
-                # Rerun để hiển thị profile
-                if st.session_state.wiki_state['selected_char']:
-                    st.rerun()
+                start_vision_batch(uploaded)
+
+            if vision_job_keys():
+                vision_progress()
+            elif not stale:
+                show_vision_results()
             
-            # Hiển thị nếu đã có kết quả
-            if st.session_state.wiki_state['selected_char']:
+            # Hiển thị nếu đã có kết quả (profile của tab Search Name đã render ở tab kia)
+            if st.session_state.wiki_state['mode'] == 'image' and st.session_state.wiki_state['selected_char']:
                 render_profile()
+        elif st.session_state.vision_batch:
+            cancel_vision_batch()
+
 def show_contact_page():
     set_global_style("https://images.unsplash.com/photo-1534528741775-53994a69daeb?q=80&w=1964&auto=format&fit=crop")
     show_navbar()
@@ -448,6 +822,46 @@ def show_contact_page():
     
     st.markdown('<div class="content-box"><h2>📞 Contact Us</h2><p>Email: admin@itooklibrary.com</p></div>', unsafe_allow_html=True)
 
+def show_admin_page():
+    set_global_style("test.jpg")
+    show_navbar()
+    if not is_admin():
+        st.error("Not authorized.")
+        return
+
+    st.title("📈 Metrics")
+    warmup = start_warmup()
+    st.caption(f"Warmup: {'ready' if warmup.ready else 'running'}"
+               + (f" · failed: {', '.join(warmup.failed)}" if warmup.failed else ""))
+
+    st.subheader("External calls")
+    rows = external_summary()
+    if rows: st.dataframe(rows, use_container_width=True, hide_index=True)
+    else: st.info("No external calls yet.")
+
+    st.subheader("Models")
+    rows = router_summary()
+    if rows: st.dataframe(rows, use_container_width=True, hide_index=True)
+    else: st.info("No Gemini calls yet.")
+    hedges = hedge_summary()
+    if hedges: st.caption("Hedged calls: " + " · ".join(f"{k} {v:g}" for k, v in sorted(hedges.items())))
+
+    st.subheader("Tokens")
+    rows = get_token_ledger().summary()
+    if rows: st.dataframe(rows, use_container_width=True, hide_index=True)
+    else: st.info("No tokens spent yet.")
+
+    st.subheader("Caches")
+    rows = cache_summary()
+    if rows: st.dataframe(rows, use_container_width=True, hide_index=True)
+    else: st.info("No cache lookups yet.")
+
+    text = REGISTRY.render()
+    st.download_button("⬇️ metrics.prom", text, file_name="metrics.prom", mime="text/plain")
+    st.caption(f"Also written every {WRITE_INTERVAL}s to `{METRICS_FILE}`")
+    with st.expander("Prometheus text"):
+        st.code(text, language="text")
+
 
 # --- 8. PAGE ROUTER ---
 if st.session_state.current_page == 'home': show_homepage()
@@ -455,6 +869,7 @@ elif st.session_state.current_page == 'wiki': show_wiki_page()
 elif st.session_state.current_page == 'genre': show_genre_page()
 elif st.session_state.current_page == 'recommend': show_recommend_page()
 elif st.session_state.current_page == 'favorites': show_favorites_page()
+elif st.session_state.current_page == 'admin': show_admin_page()
 elif st.session_state.current_page == 'contact': 
     set_global_style("test.jpg")
     show_navbar()
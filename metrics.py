@@ -0,0 +1,264 @@
+import bisect
+import os
+import re
+import threading
+import time
+
+from storage import CACHE_DIR
+
+# --- METRICS ---
+# Đo latency / status / retry của Jikan và Gemini và tỉ lệ hit của các cache,
+# xuất ra text format của Prometheus (file định kỳ + trang admin).
+# Chỉ dùng stdlib để không thêm dependency.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_FILE = os.environ.get("ITOOK_METRICS_FILE", os.path.join(CACHE_DIR, "metrics.prom"))
+WRITE_INTERVAL = 15
+
+HELP = {
+    "itook_external_request_seconds": ("histogram", "Latency of one external HTTP/API attempt"),
+    "itook_external_requests_total": ("counter", "External call attempts by status (ok, 2xx-5xx code, error)"),
+    "itook_external_retries_total": ("counter", "Retries of external calls"),
+    "itook_backoff_seconds_total": ("counter", "Seconds spent backing off after rate limiting"),
+    "itook_cache_lookups_total": ("counter", "Cache lookups"),
+    "itook_cache_misses_total": ("counter", "Cache misses (lookups that had to do the work)"),
+    "itook_gemini_tokens_total": ("counter", "Gemini tokens by feature and kind (input, output) from usage_metadata"),
+    "itook_gemini_budget_rejections_total": ("counter", "Gemini calls refused because the feature's hourly token budget was spent"),
+    "itook_model_request_seconds": ("histogram", "Latency of one Gemini call by model and task"),
+    "itook_model_requests_total": ("counter", "Gemini calls by model, task and status"),
+    "itook_model_hedges_total": ("counter", "Hedged Gemini calls by outcome (primary_won, hedge_won, skipped, failed)"),
+}
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # name -> {label key: value}
+        self._histograms = {}  # name -> {label key: [bucket counts..., sum, count]}
+        self._collectors = []  # fn() -> [(name, labels, value)] đọc lúc render
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            k = _key(labels)
+            series[k] = series.get(k, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            k = _key(labels)
+            h = series.get(k)
+            if h is None:
+                h = series[k] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            i = bisect.bisect_left(LATENCY_BUCKETS, value)
+            if i < len(LATENCY_BUCKETS):
+                h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def register_collector(self, fn):
+        with self._lock:
+            self._collectors.append(fn)
+
+    def counters(self, name):
+        with self._lock:
+            return {k: v for k, v in self._counters.get(name, {}).items()}
+
+    def histograms(self, name):
+        with self._lock:
+            return {k: list(v) for k, v in self._histograms.get(name, {}).items()}
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            histograms = {n: {k: list(v) for k, v in s.items()} for n, s in self._histograms.items()}
+            collectors = list(self._collectors)
+
+        for name, series in sorted(histograms.items()):
+            _header(lines, name)
+            for k, h in sorted(series.items()):
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS, h):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_fmt(k + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_fmt(k + (('le', '+Inf'),))} {h[-1]}")
+                lines.append(f"{name}_sum{_fmt(k)} {h[-2]:.6f}")
+                lines.append(f"{name}_count{_fmt(k)} {h[-1]}")
+        for name, series in sorted(counters.items()):
+            _header(lines, name)
+            for k, v in sorted(series.items()):
+                lines.append(f"{name}{_fmt(k)} {v:g}")
+
+        gauges = {}
+        for fn in collectors:
+            try:
+                for name, labels, value in fn():
+                    gauges.setdefault(name, []).append((_key(labels), value))
+            except Exception:
+                continue
+        for name, samples in sorted(gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            for k, v in sorted(samples):
+                lines.append(f"{name}{_fmt(k)} {v:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _header(lines, name):
+    kind, text = HELP.get(name, ("untyped", name))
+    lines.append(f"# HELP {name} {text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _fmt(key):
+    if not key:
+        return ""
+    parts = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+    return "{" + parts + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def histogram_quantile(q, h):
+    """Ước lượng quantile từ bucket (nội suy tuyến tính như Prometheus)"""
+    total = h[-1]
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for bound, n in zip(LATENCY_BUCKETS, h):
+        if cumulative + n >= rank and n:
+            return lower + (bound - lower) * (rank - cumulative) / n
+        cumulative += n
+        lower = bound
+    return LATENCY_BUCKETS[-1]
+
+
+REGISTRY = Registry()
+
+
+# --- HELPERS cho code gọi ---
+
+def endpoint_label(path):
+    """'characters/417/full?x=1' → 'characters/{id}/full' để tránh label bùng nổ"""
+    path = path.split("?", 1)[0].strip("/")
+    return re.sub(r"/\d+(?=/|$)", "/{id}", path)
+
+
+def record_request(service, endpoint, status, seconds):
+    REGISTRY.observe("itook_external_request_seconds", seconds, service=service, endpoint=endpoint)
+    REGISTRY.inc("itook_external_requests_total", service=service, endpoint=endpoint, status=str(status))
+
+
+def record_retry(service, endpoint, reason):
+    REGISTRY.inc("itook_external_retries_total", service=service, endpoint=endpoint, reason=reason)
+
+
+def record_backoff(service, seconds):
+    REGISTRY.inc("itook_backoff_seconds_total", seconds, service=service)
+
+
+def cache_lookup(cache):
+    REGISTRY.inc("itook_cache_lookups_total", cache=cache)
+
+
+def cache_miss(cache):
+    REGISTRY.inc("itook_cache_misses_total", cache=cache)
+
+
+def cache_result(cache, hit):
+    cache_lookup(cache)
+    if not hit:
+        cache_miss(cache)
+
+
+# --- TÓM TẮT cho trang admin ---
+
+def external_summary():
+    """Mỗi (service, endpoint): số lần gọi, p50/p95/p99, tỉ lệ lỗi / 429, số retry"""
+    statuses = {}
+    for k, v in REGISTRY.counters("itook_external_requests_total").items():
+        labels = dict(k)
+        statuses.setdefault((labels["service"], labels["endpoint"]), {})[labels["status"]] = v
+    retries = {}
+    for k, v in REGISTRY.counters("itook_external_retries_total").items():
+        labels = dict(k)
+        ep = (labels["service"], labels["endpoint"])
+        retries[ep] = retries.get(ep, 0) + v
+
+    rows = []
+    for k, h in sorted(REGISTRY.histograms("itook_external_request_seconds").items()):
+        labels = dict(k)
+        ep = (labels["service"], labels["endpoint"])
+        counts = statuses.get(ep, {})
+        total = sum(counts.values()) or 1
+        ok = sum(v for s, v in counts.items() if s in ("ok", "304") or s.startswith("2"))
+        rows.append({
+            "service": ep[0], "endpoint": ep[1], "requests": h[-1],
+            "p50 (s)": histogram_quantile(0.5, h), "p95 (s)": histogram_quantile(0.95, h),
+            "p99 (s)": histogram_quantile(0.99, h),
+            "error %": 100 * (total - ok) / total, "429 %": 100 * counts.get("429", 0) / total,
+            "retries": retries.get(ep, 0),
+        })
+    return rows
+
+
+def cache_summary():
+    """Mỗi cache: lookups, misses, hit ratio"""
+    misses = {dict(k)["cache"]: v for k, v in REGISTRY.counters("itook_cache_misses_total").items()}
+    rows = []
+    for k, lookups in sorted(REGISTRY.counters("itook_cache_lookups_total").items()):
+        cache = dict(k)["cache"]
+        miss = min(misses.get(cache, 0), lookups)
+        rows.append({"cache": cache, "lookups": lookups, "misses": miss,
+                     "hit %": 100 * (lookups - miss) / lookups if lookups else 0.0})
+    return rows
+
+
+class Timer:
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.monotonic() - self.started
+        return False
+
+
+def write_metrics_file(path=METRICS_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp, path)
+
+
+_writer_started = False
+_writer_lock = threading.Lock()
+
+
+def start_metrics_writer(path=METRICS_FILE, interval=WRITE_INTERVAL):
+    """Ghi file metrics định kỳ cho node_exporter textfile collector / scraper"""
+    global _writer_started
+    with _writer_lock:
+        if _writer_started:
+            return
+        _writer_started = True
+
+    def _loop():
+        while True:
+            try:
+                write_metrics_file(path)
+            except OSError:
+                pass
+            time.sleep(interval)
+
+    threading.Thread(target=_loop, name="itook-metrics", daemon=True).start()
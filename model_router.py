@@ -0,0 +1,310 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import google.generativeai as genai
+
+from metrics import REGISTRY
+from workers import get_executor
+
+# --- MODEL ROUTER ---
+# Mỗi loại việc (vision, recommend, profile...) có danh sách tier model theo thứ
+# tự ưu tiên. Router đo latency / tỉ lệ lỗi gần đây theo (task, tier) - mỗi
+# task so với deadline của chính nó, recommend 8s không làm profile_stream bị
+# coi là chậm - rồi chọn tier đầu tiên còn "khoẻ"; nếu lời gọi chính vượt deadline p95 thì gửi thêm một
+# bản hedge sang tier kế tiếp và lấy kết quả nào về trước.
+# Bản thua không huỷ được (HTTP đang chạy) nên vẫn tốn quota: hedge chỉ gửi khi
+# hedge_gate admit được đúng số token ước lượng, và tối đa HEDGE_RATIO số lời
+# gọi của task trong cửa sổ → phần tốn thêm bị chặn ở ~HEDGE_RATIO quota.
+
+TIERS = {
+    "fast": os.environ.get("GEMINI_MODEL_FAST", "gemini-2.5-flash-lite"),
+    "standard": os.environ.get("GEMINI_MODEL_STANDARD", "gemini-2.5-flash"),
+}
+
+# task -> tier theo thứ tự ưu tiên (tier đầu là chất lượng mong muốn)
+TASK_TIERS = {
+    "vision": ("fast", "standard"),  # chỉ cần trả về một cái tên
+    "recommend": ("standard", "fast"),
+    "profile": ("standard", "fast"),
+    "profile_stream": ("standard", "fast"),
+    "profile_prefetch": ("standard",),  # việc nền: không hedge, không tốn quota thêm
+    "profile_batch": ("standard",),
+}
+
+# Deadline mặc định (giây) khi model chưa đủ mẫu để tính p95
+DEFAULT_DEADLINE = {
+    "vision": 4.0,
+    "recommend": 12.0,
+    "profile": 12.0,
+    "profile_stream": 6.0,  # tới lúc có response stream, chưa tính đọc hết chunk
+}
+
+WINDOW_SIZE = 50  # số lần gọi gần nhất giữ lại cho mỗi model
+WINDOW_SECONDS = 600  # bỏ mẫu cũ hơn 10 phút
+MIN_SAMPLES = 5  # ít hơn thì chưa đánh giá model
+MAX_ERROR_RATE = 0.3
+HEDGE_WORKERS = 8
+HEDGE_RATIO = 0.1  # tối đa 10% lời gọi mỗi task được hedge
+
+
+class ModelStats:
+    """Latency + lỗi của các lần gọi gần nhất tới một model (rolling window)"""
+
+    def __init__(self, size=WINDOW_SIZE, max_age=WINDOW_SECONDS):
+        self.max_age = max_age
+        self._samples = deque(maxlen=size)  # (at, seconds, ok)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self._samples.append((time.monotonic(), seconds, ok))
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            return [s for s in self._samples if s[0] >= cutoff]
+
+    def snapshot(self):
+        """{n, error_rate, p50, p95} của cửa sổ hiện tại; latency chỉ tính lần gọi thành công"""
+        samples = self._recent()
+        latencies = sorted(seconds for _, seconds, ok in samples if ok)
+        errors = sum(1 for _, _, ok in samples if not ok)
+
+        def _pct(q):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            "n": len(samples),
+            "error_rate": errors / len(samples) if samples else 0.0,
+            "p50": _pct(0.5),
+            "p95": _pct(0.95),
+        }
+
+
+class ModelRouter:
+    """
+    Chọn model theo task và hedge lời gọi chậm.
+    factory(model_name) tạo model (mặc định genai.GenerativeModel) → test với model giả được.
+    hedge_gate(est_tokens) trả grant (truthy) nếu được phép gửi thêm bản hedge (vd. còn quota);
+    grant có settle(tokens) thì được settle bằng usage(result) thật của bản hedge khi nó xong.
+    """
+
+    def __init__(self, factory=None, tiers=None, task_tiers=None, deadlines=None, hedge_gate=None,
+                 usage=None, hedge_ratio=HEDGE_RATIO):
+        self.factory = factory or (lambda name: genai.GenerativeModel(name))
+        self.tiers = dict(tiers or TIERS)
+        self.task_tiers = dict(task_tiers or TASK_TIERS)
+        self.deadlines = dict(DEFAULT_DEADLINE if deadlines is None else deadlines)
+        self.hedge_gate = hedge_gate
+        self.usage = usage
+        self.hedge_ratio = hedge_ratio
+        self._calls = {}  # task -> deque[(at, hedged)] trong WINDOW_SECONDS
+        self._models = {}
+        self._stats = {}  # (task, tier) -> ModelStats, dùng để route / tính deadline
+        self._model_stats = {}  # model name -> ModelStats gộp mọi task, chỉ để hiển thị
+        self._lock = threading.Lock()
+
+    def model(self, tier):
+        name = self.tiers[tier]
+        with self._lock:
+            if name not in self._models:
+                self._models[name] = self.factory(name)
+            return self._models[name]
+
+    def stats(self, task, tier):
+        key = (task, tier)
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = ModelStats()
+            return self._stats[key]
+
+    def model_stats(self, tier):
+        name = self.tiers[tier]
+        with self._lock:
+            if name not in self._model_stats:
+                self._model_stats[name] = ModelStats()
+            return self._model_stats[name]
+
+    def warm(self):
+        """Tạo sẵn model của mọi tier (warmup lúc khởi động)"""
+        return [self.model(tier) for tier in self.tiers]
+
+    def candidates(self, task):
+        """Tier theo thứ tự sẽ thử: tier khoẻ đầu tiên lên trước, phần còn lại giữ thứ tự ưu tiên"""
+        tiers = [t for t in self.task_tiers.get(task, ("standard",)) if t in self.tiers]
+        deadline = self.deadlines.get(task)
+        scored = []
+        for rank, tier in enumerate(tiers):
+            snap = self.stats(task, tier).snapshot()
+            healthy = snap["n"] < MIN_SAMPLES or (
+                snap["error_rate"] <= MAX_ERROR_RATE
+                and (deadline is None or snap["p95"] is None or snap["p95"] <= deadline))
+            # Không tier nào khoẻ → ưu tiên model ít lỗi, nhanh hơn
+            scored.append((not healthy, 0 if healthy else snap["error_rate"],
+                           0 if healthy else (snap["p95"] or float("inf")), rank, tier))
+        return [s[-1] for s in sorted(scored)]
+
+    def route(self, task):
+        """Tier chính cho task"""
+        return self.candidates(task)[0]
+
+    def deadline(self, task, tier):
+        """Bao lâu thì hedge: p95 của task trên tier (khi đủ mẫu), không thì deadline mặc định của task"""
+        snap = self.stats(task, tier).snapshot()
+        if snap["n"] >= MIN_SAMPLES and snap["p95"] is not None:
+            return snap["p95"]
+        return self.deadlines.get(task)
+
+    def _timed(self, task, tier, call):
+        model = self.model(tier)
+        started = time.perf_counter()
+        try:
+            result = call(model)
+        except Exception:
+            self._observe(task, tier, time.perf_counter() - started, False)
+            raise
+        self._observe(task, tier, time.perf_counter() - started, True)
+        return result
+
+    def _observe(self, task, tier, seconds, ok):
+        self.stats(task, tier).record(seconds, ok)
+        self.model_stats(tier).record(seconds, ok)
+        model = self.tiers[tier]
+        REGISTRY.observe("itook_model_request_seconds", seconds, model=model, task=task)
+        REGISTRY.inc("itook_model_requests_total", model=model, task=task, status="ok" if ok else "error")
+
+    def _count_call(self, task):
+        """Ghi một lời gọi của task; trả về (cửa sổ [at, hedged] của task, entry của lời gọi này)"""
+        now = time.monotonic()
+        entry = [now, False]
+        with self._lock:
+            calls = self._calls.setdefault(task, deque())
+            while calls and now - calls[0][0] >= WINDOW_SECONDS:
+                calls.popleft()
+            calls.append(entry)
+        return calls, entry
+
+    def _claim_hedge(self, calls, entry):
+        """Còn trong hạn mức HEDGE_RATIO → đánh dấu lời gọi này là đã hedge"""
+        with self._lock:
+            hedged = sum(1 for _, h in calls if h)
+            if hedged + 1 > max(1.0, self.hedge_ratio * len(calls)):
+                return False
+            entry[1] = True
+            return True
+
+    def _hedged(self, task, tier, call, grant):
+        result = self._timed(task, tier, call)
+        settle = getattr(grant, "settle", None)
+        if settle is not None and self.usage is not None:
+            settle(self.usage(result))
+        return result
+
+    def call(self, task, call, est_tokens=None):
+        """
+        call(model) → kết quả, chạy trên tier được chọn. Quá deadline p95 mà chưa
+        xong → gửi bản hedge sang tier kế tiếp, trả kết quả về trước. Lỗi của
+        một bên thì chờ bên còn lại; cả hai lỗi thì raise lỗi của lời gọi chính.
+        est_tokens: ước lượng token của một lời gọi, để hedge_gate admit bản hedge.
+        """
+        tiers = self.candidates(task)
+        primary = tiers[0]
+        deadline = self.deadline(task, primary)
+        if len(tiers) < 2 or deadline is None:
+            return self._timed(task, primary, call)
+
+        calls, entry = self._count_call(task)
+        pool = get_executor("model-hedge", max_workers=HEDGE_WORKERS)
+        main = pool.submit(self._timed, task, primary, call)
+        done, _ = wait([main], timeout=deadline)
+        if done:
+            return main.result()
+        grant = None
+        if self._claim_hedge(calls, entry):
+            grant = self.hedge_gate(est_tokens) if self.hedge_gate is not None else True
+            if not grant:
+                with self._lock:
+                    entry[1] = False
+        if not grant:
+            REGISTRY.inc("itook_model_hedges_total", task=task, outcome="skipped")
+            return main.result()
+
+        hedge = pool.submit(self._hedged, task, tiers[1], call, grant)
+        pending = {main, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # Bên thua vẫn chạy tới xong ở pool (không huỷ được HTTP) - chỉ bỏ kết quả
+                    REGISTRY.inc("itook_model_hedges_total", task=task,
+                                 outcome="hedge_won" if future is hedge else "primary_won")
+                    return future.result()
+        REGISTRY.inc("itook_model_hedges_total", task=task, outcome="failed")
+        return main.result()
+
+    def summary(self):
+        """Stats hiện tại theo model, gộp mọi task (trang admin)"""
+        with self._lock:
+            names = list(self._model_stats)
+        return {name: self._model_stats[name].snapshot() for name in names}
+
+
+def router_summary():
+    """Mỗi model: số lần gọi trong cửa sổ, tỉ lệ lỗi, p50/p95, task đang được route tới nó"""
+    if _router is None:
+        return []
+    routed = {}
+    for task in _router.task_tiers:
+        routed.setdefault(_router.tiers[_router.route(task)], []).append(task)
+    rows = []
+    for name, snap in sorted(_router.summary().items()):
+        rows.append({
+            "model": name, "calls": snap["n"], "error %": 100 * snap["error_rate"],
+            "p50 (s)": snap["p50"], "p95 (s)": snap["p95"], "routed tasks": ", ".join(routed.get(name, [])),
+        })
+    return rows
+
+
+def hedge_summary():
+    """Số lần hedge theo kết quả (primary_won, hedge_won, skipped, failed)"""
+    counts = {}
+    for k, v in REGISTRY.counters("itook_model_hedges_total").items():
+        outcome = dict(k)["outcome"]
+        counts[outcome] = counts.get(outcome, 0) + v
+    return counts
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Process-wide ModelRouter; hedge chỉ khi scheduler còn quota rảnh cho đúng số token ước lượng"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            from gemini_scheduler import get_scheduler
+            from prompts import usage_tokens
+            _router = ModelRouter(
+                hedge_gate=lambda est_tokens: get_scheduler().try_admit(tokens=est_tokens or 1000),
+                usage=lambda response: sum(usage_tokens(response)))
+        return _router
+
+
+def _router_samples():
+    if _router is None:
+        return []
+    samples = []
+    for name, snap in _router.summary().items():
+        samples.append(("itook_model_error_rate", {"model": name}, snap["error_rate"]))
+        if snap["p95"] is not None:
+            samples.append(("itook_model_p95_seconds", {"model": name}, snap["p95"]))
+    return samples
+
+
+REGISTRY.register_collector(_router_samples)
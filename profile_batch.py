@@ -0,0 +1,132 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import google.generativeai as genai
+
+from ai_service import build_batch_profile_prompt
+from character_index import get_character_index
+from gemini_scheduler import PRIORITY_BACKGROUND, estimate_tokens, get_scheduler
+from jikan_client import get_client
+from model_router import get_router
+from profile_store import get_profile_store
+from prompts import get_token_ledger
+
+log = logging.getLogger(__name__)
+
+# --- OFFLINE PROFILE PRE-GENERATION ---
+# Chạy ngoài giờ cao điểm: lấy top-N nhân vật theo favorites từ Jikan, gộp vài
+# nhân vật vào một prompt, viết profile trong giới hạn token và lưu vào
+# profile store để generate_ai_stream trả về ngay không cần gọi API.
+#
+#   GEMINI_API_KEY=... python profile_batch.py --top 200 --batch-size 4 --token-budget 300000
+
+OUTPUT_TOKENS_PER_PROFILE = 350
+BACKOFF_TIMES = [10, 30, 60]
+
+
+def fetch_top_characters(top_n):
+    """Top nhân vật theo favorites (Jikan /top/characters đã sort sẵn)"""
+    chars = []
+    page = 1
+    while len(chars) < top_n:
+        payload = get_client().get("top/characters", params={'page': page, 'limit': 25})
+        if payload is None:
+            break
+        chars.extend(payload.get('data', []))
+        if not payload.get('pagination', {}).get('has_next_page'):
+            break
+        page += 1
+    get_character_index().harvest(chars)
+    return chars[:top_n]
+
+
+def parse_batch_response(text):
+    text = text.strip().replace("```json", "").replace("```", "").strip()
+    data = json.loads(text)
+    return {int(k): v.strip() for k, v in data.items() if isinstance(v, str) and v.strip()}
+
+
+def generate_batch(model, chars):
+    """
+    Một lời gọi Gemini cho cả nhóm; trả về ({char_id: profile}, tokens đã dùng).
+    Trả lời không parse được vẫn tính token (đã tốn) với {} profile; lỗi SDK sau
+    khi hết lượt retry thì raise.
+    """
+    prompt = build_batch_profile_prompt(chars)
+    est = estimate_tokens(prompt, expected_output=OUTPUT_TOKENS_PER_PROFILE * len(chars))
+    scheduler = get_scheduler()
+    for attempt in range(len(BACKOFF_TIMES) + 1):
+        admission = scheduler.admit(PRIORITY_BACKGROUND, est)
+        try:
+            response = model.generate_content(prompt)
+        except Exception as e:
+            retryable = any(x in str(e) for x in ["429", "ResourceExhausted", "503", "quota"])
+            if not retryable or attempt == len(BACKOFF_TIMES):
+                raise  # hết lượt retry cũng raise → vòng lặp không bao giờ chạy hết
+            scheduler.pause(BACKOFF_TIMES[attempt])
+            continue
+        used = get_token_ledger().record_response("profile_batch", response) or est
+        admission.settle(used)
+        try:
+            return parse_batch_response(response.text), used
+        except (ValueError, AttributeError) as e:
+            # JSON hỏng / response bị chặn (response.text raise ValueError)
+            log.warning("batch %s: unusable response: %s", [c['mal_id'] for c in chars], e)
+            return {}, used
+
+
+def run(top_n, batch_size, token_budget, force=False):
+    store = get_profile_store()
+    chars = fetch_top_characters(top_n)
+    if force:
+        todo = chars
+    else:
+        missing = set(store.missing([c['mal_id'] for c in chars]))
+        todo = [c for c in chars if c['mal_id'] in missing]
+    print(f"{len(chars)} top characters, {len(todo)} need a profile")
+
+    router = get_router()
+    model = router.model(router.route("profile_batch"))
+    spent = 0
+    written = 0
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start:start + batch_size]
+        est = estimate_tokens(build_batch_profile_prompt(batch), OUTPUT_TOKENS_PER_PROFILE * len(batch))
+        if spent + est > token_budget:
+            print(f"Token budget reached ({spent}/{token_budget}), stopping")
+            break
+        started = time.monotonic()
+        try:
+            profiles, used = generate_batch(model, batch)
+        except Exception as e:
+            # Hết retry quota hoặc lỗi SDK khác → dừng, giữ những gì đã ghi
+            log.warning("batch %s failed, stopping: %s: %s", [c['mal_id'] for c in batch], type(e).__name__, e)
+            break
+        spent += used
+        names = {c['mal_id']: c.get('name') for c in batch}
+        for char_id, text in profiles.items():
+            if char_id in names:
+                store.put(char_id, text, name=names[char_id], source="batch")
+                written += 1
+        print(f"  {len(profiles)}/{len(batch)} profiles in {time.monotonic() - started:.1f}s ({spent} tokens so far)")
+    print(f"Done: {written} profiles written, {spent} tokens spent")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate AI profiles for the most popular characters")
+    parser.add_argument("--top", type=int, default=100, help="number of top characters by favorites")
+    parser.add_argument("--batch-size", type=int, default=4, help="characters packed into one prompt")
+    parser.add_argument("--token-budget", type=int, default=200_000, help="stop once this many tokens are spent")
+    parser.add_argument("--force", action="store_true", help="regenerate profiles that already exist")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        raise SystemExit("GEMINI_API_KEY is not set")
+    genai.configure(api_key=api_key)
+    run(args.top, args.batch_size, args.token_budget, args.force)
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from storage import connect
+
+# --- PERSISTENT AI PROFILE STORE ---
+# Profile do AI viết (batch job hoặc lúc người dùng bấm Generate) được lưu
+# SQLite, nên nhân vật phổ biến hiển thị ngay mà không cần gọi Gemini.
+
+DB_FILE = "profiles.sqlite3"
+MAX_AGE = 30 * 86400
+
+
+class ProfileStore:
+    def __init__(self, db_file=DB_FILE, max_age=MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._memory = {}  # char_id -> (created_at, text)
+        self._conn = connect(db_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS profiles (
+                char_id INTEGER PRIMARY KEY,
+                name TEXT,
+                text TEXT NOT NULL,
+                source TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )""")
+
+    def get(self, char_id):
+        """Profile còn hạn của nhân vật, hoặc None"""
+        if char_id is None:
+            return None
+        with self._lock:
+            entry = self._memory.get(char_id)
+            if entry is None:
+                row = self._conn.execute(
+                    "SELECT created_at, text FROM profiles WHERE char_id = ?", (char_id,)).fetchone()
+                if row is None:
+                    return None
+                entry = self._memory[char_id] = (row[0], row[1])
+        if time.time() - entry[0] > self.max_age:
+            return None
+        return entry[1]
+
+    def put(self, char_id, text, name=None, source="live"):
+        if char_id is None or not text:
+            return
+        now = time.time()
+        with self._lock:
+            self._memory[char_id] = (now, text)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO profiles (char_id, name, text, source, created_at) VALUES (?, ?, ?, ?, ?)",
+                (char_id, name, text, source, now))
+
+    def missing(self, char_ids):
+        """Các id chưa có profile còn hạn"""
+        return [cid for cid in char_ids if self.get(cid) is None]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_profile_store():
+    """Process-wide ProfileStore"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ProfileStore()
+        return _store
@@ -0,0 +1,208 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from metrics import REGISTRY
+
+# --- PROMPT LAYER ---
+# Biography từ Jikan thường dài, lẫn ghi chú nguồn, dòng "[Written by ...]",
+# khoảng trắng thừa → rút gọn trước khi đưa vào prompt: bỏ rác, giữ dòng
+# thông tin ngắn (Age, Height...) và các câu quan trọng nhất, đúng thứ tự gốc.
+# Kèm sổ token: đếm input/output thực tế (usage_metadata) theo feature và chặn
+# feature vượt ngân sách token mỗi giờ.
+
+BIO_CHARS = 1200  # ~300 token cho biography của một profile
+BATCH_BIO_CHARS = 900  # mỗi nhân vật trong prompt batch
+FACT_SHARE = 1 / 3  # dòng "Key: value" chiếm tối đa phần này của max_chars, còn lại để cho câu
+
+_SOURCE_NOTES = re.compile(
+    r"[\(\[]\s*(?:source|sources|taken from|written by|edited by|adapted from)\b[^\)\]]*[\)\]]",
+    re.I)
+_BOILERPLATE = re.compile(
+    r"^\s*(?:no biography written\.?|no information has been added.*|\(?spoilers?\)?:?|"
+    r"\[/?spoiler\]|\(?no voice actors.*|read more.*|edit)\s*$", re.I | re.M)
+_SPOILER_TAGS = re.compile(r"\[/?spoiler\]", re.I)
+_FACT_LINE = re.compile(r"^[A-Z][\w ()'/-]{1,30}:\s*\S.{0,80}$")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+(?=[\"'“(A-Z0-9])")
+_KEYWORDS = re.compile(
+    r"\b(?:power|powers|ability|abilities|skill|technique|jutsu|quirk|magic|strength|strongest|"
+    r"personality|dream|goal|ambition|known|leader|captain|member|rival|friend|family|born|"
+    r"protagonist|main character|kind|cold|cheerful|loyal|determined)\b", re.I)
+
+
+def clean_biography(text):
+    """Bỏ ghi chú nguồn, boilerplate, tag spoiler và khoảng trắng lặp"""
+    if not text:
+        return ""
+    text = _SOURCE_NOTES.sub("", text)
+    text = _SPOILER_TAGS.sub("", text)
+    text = _BOILERPLATE.sub("", text)
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    paragraphs = []
+    for line in lines:
+        if line:
+            paragraphs.append(line)
+        elif paragraphs and paragraphs[-1]:
+            paragraphs.append("")
+    return "\n".join(paragraphs).strip()
+
+
+def _score(sentence, index, name_parts):
+    score = 3.0 if index < 2 else 1.5 if index < 5 else 0.0  # đoạn mở đầu thường là câu giới thiệu
+    lowered = sentence.casefold()
+    if any(part in lowered for part in name_parts):
+        score += 1.0
+    score += min(2, len(_KEYWORDS.findall(sentence))) * 0.75
+    if len(sentence) < 25 or len(sentence) > 400:
+        score -= 1.5
+    return score
+
+
+def compact_biography(text, name=None, max_chars=BIO_CHARS):
+    """
+    Biography gọn cho prompt: làm sạch, giữ tối đa vài dòng "Key: value" (không quá
+    FACT_SHARE của max_chars), rồi chọn câu theo điểm (vị trí đầu, nhắc tên, từ khoá về
+    tính cách / sức mạnh) tới khi hết max_chars; câu được giữ theo thứ tự gốc, câu trùng bị bỏ.
+    """
+    text = clean_biography(text)
+    if len(text) <= max_chars:
+        return text
+
+    facts, sentences, seen = [], [], set()
+    fact_room = int(max_chars * FACT_SHARE)
+    for line in text.splitlines():
+        if _FACT_LINE.match(line):
+            if len(facts) < 6 and len(line) + 1 <= fact_room:
+                facts.append(line)
+                fact_room -= len(line) + 1
+            continue
+        for sentence in _SENTENCE_SPLIT.split(line):
+            sentence = sentence.strip()
+            key = sentence.casefold()
+            if sentence and key not in seen:
+                seen.add(key)
+                sentences.append(sentence)
+
+    fact_block = "\n".join(facts)
+    budget = max_chars - len(fact_block) - (2 if facts else 0)
+    name_parts = [p for p in (name or "").casefold().replace(",", " ").split() if len(p) > 2]
+    ranked = sorted(range(len(sentences)), key=lambda i: -_score(sentences[i], i, name_parts))
+    keep, used = set(), 0
+    for i in ranked:
+        cost = len(sentences[i]) + 1
+        if used + cost <= budget:
+            keep.add(i)
+            used += cost
+    body = " ".join(sentences[i] for i in sorted(keep))
+    if not body and sentences:
+        body = sentences[0][:max(0, budget - 3)].rstrip() + "..."
+    return "\n\n".join(part for part in (fact_block, body) if part)
+
+
+# --- TOKEN ACCOUNTING ---
+
+BUDGET_WINDOW = 3600.0
+# Token mỗi giờ theo feature (GEMINI_BUDGET_<FEATURE> để đổi); feature không có ở đây thì không giới hạn
+FEATURE_BUDGETS = {
+    feature: int(os.environ.get(f"GEMINI_BUDGET_{feature.upper()}", default))
+    for feature, default in {
+        "recommend": 400_000,
+        "vision": 200_000,
+        "profile": 300_000,
+        "profile_stream": 600_000,
+        "profile_prefetch": 200_000,
+    }.items()
+}
+
+
+class TokenBudgetExceeded(Exception):
+    def __init__(self, feature, used, budget):
+        super().__init__(f"{feature} token budget reached ({used}/{budget} tokens in the last hour)")
+        self.feature = feature
+
+
+def usage_tokens(response):
+    """(input, output) từ usage_metadata của response; (0, 0) nếu không có"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0, 0
+    prompt = getattr(usage, "prompt_token_count", 0) or 0
+    output = getattr(usage, "candidates_token_count", 0) or 0
+    return prompt, output
+
+
+class TokenLedger:
+    """Token đã dùng theo feature: tổng từ lúc chạy + cửa sổ 1 giờ để so ngân sách"""
+
+    def __init__(self, budgets=None, window=BUDGET_WINDOW):
+        self.budgets = dict(FEATURE_BUDGETS if budgets is None else budgets)
+        self.window = window
+        self._lock = threading.Lock()
+        self._recent = {}  # feature -> deque[(at, tokens)]
+        self._totals = {}  # feature -> {"calls", "input", "output"}
+
+    def _used(self, feature, now):
+        recent = self._recent.get(feature)
+        if not recent:
+            return 0
+        while recent and now - recent[0][0] >= self.window:
+            recent.popleft()
+        return sum(tokens for _, tokens in recent)
+
+    def check(self, feature, est_tokens):
+        """Raise TokenBudgetExceeded nếu thêm est_tokens sẽ vượt ngân sách giờ của feature"""
+        budget = self.budgets.get(feature)
+        if not budget:
+            return
+        with self._lock:
+            used = self._used(feature, time.monotonic())
+        if used + est_tokens > budget:
+            REGISTRY.inc("itook_gemini_budget_rejections_total", feature=feature)
+            raise TokenBudgetExceeded(feature, used, budget)
+
+    def record(self, feature, input_tokens, output_tokens):
+        now = time.monotonic()
+        with self._lock:
+            self._recent.setdefault(feature, deque()).append((now, input_tokens + output_tokens))
+            totals = self._totals.setdefault(feature, {"calls": 0, "input": 0, "output": 0})
+            totals["calls"] += 1
+            totals["input"] += input_tokens
+            totals["output"] += output_tokens
+        REGISTRY.inc("itook_gemini_tokens_total", input_tokens, feature=feature, kind="input")
+        REGISTRY.inc("itook_gemini_tokens_total", output_tokens, feature=feature, kind="output")
+
+    def record_response(self, feature, response):
+        """Ghi usage của một response; trả về tổng token (0 nếu response không có usage)"""
+        input_tokens, output_tokens = usage_tokens(response)
+        if input_tokens or output_tokens:
+            self.record(feature, input_tokens, output_tokens)
+        return input_tokens + output_tokens
+
+    def summary(self):
+        """Mỗi feature: số call, token input/output, trung bình mỗi call, dùng trong giờ / ngân sách"""
+        now = time.monotonic()
+        rows = []
+        with self._lock:
+            for feature, t in sorted(self._totals.items()):
+                calls = t["calls"] or 1
+                rows.append({
+                    "feature": feature, "calls": t["calls"], "input tokens": t["input"],
+                    "output tokens": t["output"], "avg in": t["input"] / calls, "avg out": t["output"] / calls,
+                    "last hour": self._used(feature, now), "budget / h": self.budgets.get(feature) or None,
+                })
+        return rows
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_token_ledger():
+    """Process-wide TokenLedger"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = TokenLedger()
+        return _ledger
@@ -0,0 +1,164 @@
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from storage import connect
+
+# --- SEMANTIC CACHE CHO AI RECOMMENDATIONS ---
+# Key = (nhóm tuổi, mood, style, loại) khớp chính xác + interests so bằng
+# TF-IDF cosine: "I like cats & cyberpunk!" và "cyberpunk, cats" dùng chung
+# một kết quả thay vì gọi Gemini lần nữa.
+# Mỗi context giữ tối đa MAX_ENTRIES_PER_CONTEXT entry (LRU, cả RAM lẫn SQLite),
+# entry hết hạn bị bỏ mỗi lần store → lookup không phải quét mọi prompt từng có.
+
+DB_FILE = "semantic_cache.sqlite3"
+SIMILARITY_THRESHOLD = 0.8
+MAX_AGE = 7 * 86400
+MAX_ENTRIES_PER_CONTEXT = 200
+
+STOPWORDS = {
+    "a", "an", "and", "the", "i", "im", "me", "my", "we", "you", "it", "is", "are", "am", "be",
+    "to", "of", "in", "on", "for", "with", "about", "at", "by", "or", "but", "so", "too", "very",
+    "like", "likes", "love", "loves", "enjoy", "enjoys", "into", "also", "really", "that", "this",
+    "things", "thing", "stuff", "lot", "lots", "some", "any", "eg", "etc",
+}
+
+
+def age_bucket(age):
+    for upper, label in [(12, "kid"), (17, "teen"), (24, "18-24"), (34, "25-34"), (49, "35-49")]:
+        if age <= upper:
+            return label
+    return "50+"
+
+
+def _stem(word):
+    for suffix in ("ing", "ers", "er", "es", "ed", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text):
+    """Lowercase, bỏ dấu câu và stopword, stem thô"""
+    words = re.findall(r"[a-z0-9]+", (text or "").casefold())
+    return [_stem(w) for w in words if w not in STOPWORDS]
+
+
+def context_key(age, mood, style, content_type):
+    return f"{age_bucket(age)}|{mood}|{style}|{content_type}".casefold()
+
+
+class SemanticCache:
+    def __init__(self, db_file=DB_FILE, threshold=SIMILARITY_THRESHOLD, max_age=MAX_AGE,
+                 max_entries=MAX_ENTRIES_PER_CONTEXT):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = connect(db_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS recommendations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                context TEXT NOT NULL,
+                tokens TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )""")
+        self._conn.execute("DELETE FROM recommendations WHERE created_at < ?", (time.time() - max_age,))
+        # context -> OrderedDict[row id -> (Counter tokens, result, created_at)], dùng gần nhất ở cuối
+        self._entries = defaultdict(OrderedDict)
+        self._df = Counter()  # document frequency trên toàn bộ entry
+        self._n_docs = 0
+        rows = self._conn.execute(
+            "SELECT id, context, tokens, result, created_at FROM recommendations ORDER BY created_at").fetchall()
+        for row_id, context, tokens, result, created_at in rows:
+            self._add(row_id, context, Counter(json.loads(tokens)), json.loads(result), created_at)
+
+    def _add(self, row_id, context, tf, result, created_at):
+        entries = self._entries[context]
+        entries[row_id] = (tf, result, created_at)
+        self._df.update(tf.keys())
+        self._n_docs += 1
+        while len(entries) > self.max_entries:
+            self._remove(context, next(iter(entries)))
+
+    def _remove(self, context, row_id):
+        """Bỏ một entry khỏi RAM + SQLite, trừ document frequency của nó (gọi khi giữ lock)"""
+        entries = self._entries[context]
+        tf, _, _ = entries.pop(row_id)
+        if not entries:
+            del self._entries[context]
+        self._df.subtract(tf.keys())
+        for token in tf:
+            if self._df[token] <= 0:
+                del self._df[token]
+        self._n_docs -= 1
+        self._conn.execute("DELETE FROM recommendations WHERE id = ?", (row_id,))
+
+    def _expire(self, now):
+        cutoff = now - self.max_age
+        for context in list(self._entries):
+            for row_id, (_, _, created_at) in list(self._entries[context].items()):
+                if created_at < cutoff:
+                    self._remove(context, row_id)
+
+    def _vector(self, tf):
+        vec = {t: c * (math.log((self._n_docs + 1) / (self._df[t] + 1)) + 1) for t, c in tf.items()}
+        norm = math.sqrt(sum(v * v for v in vec.values()))
+        return vec, norm
+
+    def _cosine(self, a, b):
+        (va, na), (vb, nb) = a, b
+        if not na or not nb:
+            return 0.0
+        return sum(w * vb.get(t, 0.0) for t, w in va.items()) / (na * nb)
+
+    def lookup(self, age, interests, mood, style, content_type):
+        """Kết quả đã lưu của request tương đương nhất (cosine ≥ threshold), hoặc None"""
+        tf = Counter(tokenize(interests))
+        if not tf:
+            return None
+        now = time.time()
+        best = (0.0, None, None)
+        with self._lock:
+            query = self._vector(tf)
+            entries = self._entries.get(context_key(age, mood, style, content_type), {})
+            for row_id, (entry_tf, result, created_at) in entries.items():
+                if now - created_at > self.max_age:
+                    continue
+                score = self._cosine(query, self._vector(entry_tf))
+                if score > best[0]:
+                    best = (score, result, row_id)
+            if best[0] < self.threshold:
+                return None
+            entries.move_to_end(best[2])
+        return best[1]
+
+    def store(self, age, interests, mood, style, content_type, result):
+        tokens = tokenize(interests)
+        if not tokens or not result:
+            return
+        context = context_key(age, mood, style, content_type)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            row_id = self._conn.execute(
+                "INSERT INTO recommendations (context, tokens, result, created_at) VALUES (?, ?, ?, ?)",
+                (context, json.dumps(tokens), json.dumps(result, ensure_ascii=False), now)).lastrowid
+            self._add(row_id, context, Counter(tokens), result, now)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Process-wide SemanticCache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache()
+        return _cache
@@ -0,0 +1,17 @@
+import os
+import sqlite3
+
+# --- LOCAL STORAGE ---
+# Các store bền vững (HTTP cache, ...) dùng chung một thư mục SQLite.
+# Đặt ITOOK_CACHE_DIR để trỏ tới volume riêng khi deploy.
+
+CACHE_DIR = os.environ.get("ITOOK_CACHE_DIR", os.path.join(os.getcwd(), ".cache"))
+
+
+def connect(filename):
+    """Open a SQLite database in CACHE_DIR, shareable across threads (callers hold their own lock)"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(CACHE_DIR, filename), check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -1,15 +1,6 @@
 import streamlit as st
-import base64
-import os
 
-def get_base64_of_bin_file(filename):
-    file_path = os.path.join(os.getcwd(), "resources", filename)
-    try:
-        with open(file_path, 'rb') as f:
-            data = f.read()
-        return base64.b64encode(data).decode()
-    except FileNotFoundError:
-        return None
+from assets import get_background_urls, get_inline_background, static_serving_enabled
 
 def set_global_style(bg_source):
     background_css = ""
@@ -27,17 +18,26 @@ def set_global_style(bg_source):
             background-position: center;
         """
     else:
-        b64_data = get_base64_of_bin_file(bg_source)
-        if b64_data:
-            ext = "jpeg" if bg_source.lower().endswith((".jpg", ".jpeg")) else "png"
+        background_css = "background-color: #0e1117;"
+        urls = get_background_urls(bg_source)
+        if urls and static_serving_enabled():
+            # Trình duyệt cache file tĩnh, rerun chỉ gửi lại URL
+            image_set = ", ".join(f'url("{url}") type("image/{fmt}")' for fmt, url in reversed(list(urls.items())))
             background_css = f"""
-                background-image: linear-gradient(rgba(0, 0, 0, 0.7), rgba(0, 0, 0, 0.7)), url("data:image/{ext};base64,{b64_data}");
+                background-image: linear-gradient(rgba(0, 0, 0, 0.7), rgba(0, 0, 0, 0.7)), url("{urls['webp']}");
+                background-image: linear-gradient(rgba(0, 0, 0, 0.7), rgba(0, 0, 0, 0.7)), image-set({image_set});
+                background-size: cover;
+                background-attachment: fixed;
+                background-position: center;
+            """
+        elif urls:
+            b64_data = get_inline_background(bg_source)
+            background_css = f"""
+                background-image: linear-gradient(rgba(0, 0, 0, 0.7), rgba(0, 0, 0, 0.7)), url("data:image/webp;base64,{b64_data}");
                 background-size: cover;
                 background-attachment: fixed;
                 background-position: center;
             """
-        else:
-            background_css = "background-color: #0e1117;"
 
     st.markdown(f"""
     <style>
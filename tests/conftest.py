@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# Module của app nằm ở thư mục gốc; cache SQLite ghi vào thư mục tạm thay vì .cache/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ITOOK_CACHE_DIR", tempfile.mkdtemp(prefix="itook-tests-"))
@@ -0,0 +1,104 @@
+import pytest
+
+import ai_service
+from gemini_scheduler import Admission
+
+
+class _Scheduler:
+    def __init__(self):
+        self.pauses = []
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    sched = _Scheduler()
+    monkeypatch.setattr(ai_service, "get_scheduler", lambda: sched)
+    monkeypatch.setattr(ai_service, "wait_for_quota", lambda *a, **k: Admission(0.0, 0))
+    return sched
+
+
+@pytest.mark.parametrize("message, status", [
+    ("429 Resource has been exhausted (e.g. check quota).", "429"),
+    ("Resource has been exhausted (check quota). limit: 500", "429"),
+    ("ResourceExhausted: too many requests", "429"),
+    ("503 The model is overloaded.", "503"),
+    ("500 An internal error has occurred.", "500"),
+    ("Request id 15003 failed", "error"),
+])
+def test_error_status(message, status):
+    assert ai_service._error_status(message) == status
+
+
+def test_quota_error_is_retried(scheduler):
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError("Resource has been exhausted (check quota). limit: 500")
+        return "ok"
+
+    result = ai_service.safe_api_call(flaky, priority=ai_service.PRIORITY_BACKGROUND, feature="test")
+    assert result == "ok"
+    assert len(calls) == 3
+    assert scheduler.pauses == [5, 10]
+
+
+def test_other_errors_are_not_retried(scheduler):
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    assert ai_service.safe_api_call(broken, priority=ai_service.PRIORITY_BACKGROUND, feature="test") is None
+    assert len(calls) == 1
+    assert scheduler.pauses == []
+
+
+def test_failed_recommendations_are_not_cached(monkeypatch):
+    answers = [None, [{"title": "Stub", "genre": "Action", "reason": "Fits."}]]
+
+    class _Semantic:
+        def lookup(self, *args):
+            return None
+
+        def store(self, *args):
+            pass
+
+    monkeypatch.setattr(ai_service, "get_semantic_cache", lambda: _Semantic())
+    monkeypatch.setattr(ai_service, "coalesced_api_call", lambda *a, **k: answers.pop(0))
+    args = (20, "budget test", "Happy", "Any", "Anime")
+    assert ai_service.get_ai_recommendations(*args) == []  # vd. bị TokenBudgetExceeded chặn
+    assert ai_service.get_ai_recommendations(*args)[0]["title"] == "Stub"
+    assert ai_service.get_ai_recommendations(*args)[0]["title"] == "Stub"
+    assert answers == []
+
+
+def test_interactive_profile_does_not_wait_for_prefetch(monkeypatch):
+    import threading
+
+    started, release = threading.Event(), threading.Event()
+
+    def fake_safe_api_call(func, *, feature, **kwargs):
+        if feature == "profile_prefetch":
+            started.set()
+            release.wait(5)
+            return "prefetched"
+        return "interactive"
+
+    monkeypatch.setattr(ai_service, "safe_api_call", fake_safe_api_call)
+    info = {'mal_id': 919191, 'name': "Prefetch Test", 'about': "A test character."}
+    prefetch = threading.Thread(target=ai_service.prefetch_ai_profile, args=(info,))
+    prefetch.start()
+    assert started.wait(5)  # prefetch đã giữ lời gọi single-flight của nó
+    try:
+        text = ai_service.generate_ai_profile_text(info['mal_id'], info['name'], info['about'])
+        assert text == "interactive"
+        assert prefetch.is_alive()  # prefetch vẫn đang chờ, user không phải chờ theo
+    finally:
+        release.set()
+        prefetch.join()
@@ -0,0 +1,18 @@
+from jikan_client import RateLimiter, TokenBucket
+
+
+def test_try_acquire_leaves_headroom_for_interactive_callers():
+    limiter = RateLimiter([TokenBucket(3, 1.0)])
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()  # chỉ còn một slot → để dành cho user
+    assert limiter.reserve() <= 0  # request interactive không phải chờ sau việc nền
+
+
+def test_try_acquire_never_queues_behind_reservations():
+    limiter = RateLimiter([TokenBucket(3, 1.0)])
+    for _ in range(3):
+        limiter.reserve()
+    tat = limiter.buckets[0].tat
+    assert not limiter.try_acquire()
+    assert limiter.buckets[0].tat == tat
@@ -0,0 +1,76 @@
+import pytest
+
+import jikan_services
+
+
+class _Client:
+    def __init__(self, payloads):
+        self.payloads = list(payloads)
+        self.calls = 0
+
+    def get(self, path, params=None):
+        self.calls += 1
+        return self.payloads.pop(0)
+
+
+def test_failed_character_lookup_is_not_cached(monkeypatch):
+    client = _Client([None, {'data': {'mal_id': 424242, 'name': "Test"}}])
+    monkeypatch.setattr(jikan_services, "get_client", lambda: client)
+    assert jikan_services.get_character_by_id(424242) is None
+    assert jikan_services.get_character_by_id(424242)['name'] == "Test"
+    assert jikan_services.get_character_by_id(424242)['name'] == "Test"
+    assert client.calls == 2
+
+
+def test_failed_character_search_is_not_cached(monkeypatch):
+    client = _Client([None, {'data': []}])
+    monkeypatch.setattr(jikan_services, "get_client", lambda: client)
+    assert jikan_services.get_character_data("nobody at all") == []
+    assert jikan_services.get_character_data("nobody at all") == []
+    assert jikan_services.get_character_data("nobody at all") == []
+    assert client.calls == 2
+
+
+def test_media_lookup_failure_is_not_a_missing_match(monkeypatch):
+    client = _Client([None, {'data': []}])
+    monkeypatch.setattr(jikan_services, "get_client", lambda: client)
+    with pytest.raises(jikan_services.JikanUnavailable):
+        jikan_services.search_media_by_title("Anime", "Some Title")
+    assert jikan_services.search_media_by_title("Anime", "Some Title") is None
+
+
+def test_of_the_day_waits_for_first_pick(monkeypatch):
+    import threading
+    release = threading.Event()
+    picked = {'mal_id': 7, 'title': "Daily"}
+
+    def slow_pick(day):
+        release.wait(1)
+        return picked
+
+    monkeypatch.setattr(jikan_services, "pick_manga_of_the_day", slow_pick)
+    pool = jikan_services.RandomMangaPool()
+    assert pool.of_the_day() is None  # chưa chọn xong, không chờ
+    threading.Timer(0.05, release.set).start()
+    assert pool.of_the_day(wait=2) == picked
+    assert pool.of_the_day() == picked
+
+
+def test_stale_prefetch_is_dropped(monkeypatch):
+    clock = [1000.0]
+    pages = iter([(["old"], True), (["fresh"], True)])
+    monkeypatch.setattr(jikan_services.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(jikan_services, "search_by_genres", lambda *args: next(pages))
+    jikan_services.prefetch_genre_page("anime", [1], "score", "desc", 2)
+    clock[0] += jikan_services.GENRE_CACHE_TTL
+    assert jikan_services.get_genre_page("anime", [1], "score", "desc", 2) == (["fresh"], True)
+    assert not jikan_services._prefetches
+
+
+def test_failed_genre_map_is_not_cached(monkeypatch):
+    client = _Client([None, {'data': [{'name': "Action", 'mal_id': 1}]}])
+    monkeypatch.setattr(jikan_services, "get_client", lambda: client)
+    assert jikan_services.get_genre_map("test-kind") == {}
+    assert jikan_services.get_genre_map("test-kind") == {"Action": 1}
+    assert jikan_services.get_genre_map("test-kind") == {"Action": 1}
+    assert client.calls == 2
@@ -0,0 +1,156 @@
+import threading
+import time
+
+import pytest
+
+import model_router
+from model_router import MIN_SAMPLES, ModelRouter
+
+TIERS = {"standard": "slow-model", "fast": "fast-model"}
+
+
+class StubModel:
+    """Model giả: latency và lỗi chỉnh theo tên model"""
+    latency = {}
+    errors = set()
+    calls = []
+    lock = threading.Lock()
+
+    def __init__(self, name):
+        self.name = name
+
+    def generate_content(self, prompt):
+        with StubModel.lock:
+            StubModel.calls.append(self.name)
+        time.sleep(StubModel.latency.get(self.name, 0.0))
+        if self.name in StubModel.errors:
+            raise RuntimeError("503 overloaded")
+        return self.name
+
+
+@pytest.fixture(autouse=True)
+def reset_stub():
+    StubModel.latency = {"slow-model": 0.0, "fast-model": 0.0}
+    StubModel.errors = set()
+    StubModel.calls = []
+
+
+def make_router(deadline=0.2, **kwargs):
+    kwargs.setdefault("hedge_ratio", 1.0)
+    return ModelRouter(factory=StubModel, tiers=TIERS, task_tiers={"task": ("standard", "fast")},
+                       deadlines={"task": deadline}, **kwargs)
+
+
+def ask(router):
+    return router.call("task", lambda model: model.generate_content("hi"), est_tokens=123)
+
+
+def test_routes_to_preferred_tier_while_healthy():
+    router = make_router()
+    for _ in range(MIN_SAMPLES):
+        assert ask(router) == "slow-model"
+    assert router.route("task") == "standard"
+
+
+def test_error_rate_moves_task_to_next_tier():
+    router = make_router()
+    StubModel.errors = {"slow-model"}
+    for _ in range(MIN_SAMPLES):
+        with pytest.raises(RuntimeError):
+            ask(router)
+    assert router.route("task") == "fast"
+    StubModel.errors = set()
+    assert ask(router) == "fast-model"
+
+
+def test_slow_p95_moves_task_to_next_tier():
+    router = make_router(deadline=0.05)
+    router.hedge_gate = lambda est: None  # chỉ đo latency, không hedge
+    StubModel.latency["slow-model"] = 0.08
+    for _ in range(MIN_SAMPLES):
+        ask(router)
+    assert router.route("task") == "fast"
+
+
+def test_hedge_fires_after_deadline_and_first_response_wins():
+    router = make_router(deadline=0.1)
+    StubModel.latency["slow-model"] = 1.0
+    started = time.monotonic()
+    assert ask(router) == "fast-model"
+    elapsed = time.monotonic() - started
+    assert 0.1 <= elapsed < 0.5
+    assert StubModel.calls == ["slow-model", "fast-model"]
+
+
+def test_no_hedge_before_deadline():
+    router = make_router(deadline=0.5)
+    StubModel.latency["slow-model"] = 0.05
+    assert ask(router) == "slow-model"
+    assert StubModel.calls == ["slow-model"]
+
+
+def test_hedge_gate_refusal_waits_for_primary():
+    seen = []
+
+    def gate(est_tokens):
+        seen.append(est_tokens)
+        return None
+
+    router = make_router(deadline=0.05, hedge_gate=gate)
+    StubModel.latency["slow-model"] = 0.2
+    assert ask(router) == "slow-model"
+    assert seen == [123]
+    assert StubModel.calls == ["slow-model"]
+
+
+def test_hedge_grant_is_settled_with_real_usage():
+    class Grant:
+        tokens = None
+
+        def settle(self, tokens):
+            self.tokens = tokens
+
+    grant = Grant()
+    router = make_router(deadline=0.05, hedge_gate=lambda est: grant, usage=lambda result: len(result))
+    StubModel.latency["slow-model"] = 0.3
+    assert ask(router) == "fast-model"
+    assert grant.tokens == len("fast-model")
+
+
+def test_hedge_ratio_bounds_duplicates():
+    router = make_router(deadline=0.02, hedge_ratio=0.1)
+    StubModel.latency["slow-model"] = 0.05
+    for _ in range(4):
+        ask(router)
+    time.sleep(0.1)  # các bản thua chạy nốt
+    assert StubModel.calls.count("fast-model") == 1
+
+
+def test_failed_primary_is_covered_by_hedge():
+    router = make_router(deadline=0.05)
+    StubModel.latency["slow-model"] = 0.1
+    StubModel.latency["fast-model"] = 0.2
+    StubModel.errors = {"slow-model"}
+    assert ask(router) == "fast-model"
+
+
+def test_default_factory_is_lazy(monkeypatch):
+    created = []
+    monkeypatch.setattr(model_router.genai, "GenerativeModel", lambda name: created.append(name) or name)
+    router = ModelRouter(tiers=TIERS)
+    assert created == []
+    router.warm()
+    assert sorted(created) == ["fast-model", "slow-model"]
+
+
+def test_slow_task_does_not_affect_other_task_on_same_model():
+    router = ModelRouter(factory=StubModel, tiers=TIERS,
+                         task_tiers={"slow": ("standard", "fast"), "quick": ("standard", "fast")},
+                         deadlines={"slow": 1.0, "quick": 0.05}, hedge_gate=lambda est: None)
+    StubModel.latency["slow-model"] = 0.08  # chậm với deadline của "quick", nhanh với "slow"
+    for _ in range(MIN_SAMPLES):
+        router.call("slow", lambda model: model.generate_content("hi"))
+    assert router.route("quick") == "standard"
+    assert router.deadline("quick", "standard") == 0.05
+    assert router.deadline("slow", "standard") >= 0.08
+    assert router.summary()["slow-model"]["n"] == MIN_SAMPLES
@@ -0,0 +1,97 @@
+import pytest
+
+import profile_batch
+from gemini_scheduler import GeminiScheduler
+
+
+class _Usage:
+    prompt_token_count = 700
+    candidates_token_count = 300
+
+
+class _Response:
+    usage_metadata = _Usage()
+
+    def __init__(self, text):
+        self.text = text
+
+
+class _Model:
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    def generate_content(self, prompt):
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return _Response(reply)
+
+
+class _Store:
+    def __init__(self):
+        self.profiles = {}
+
+    def missing(self, char_ids):
+        return [cid for cid in char_ids if cid not in self.profiles]
+
+    def put(self, char_id, text, name=None, source=None):
+        self.profiles[char_id] = text
+
+
+class _Router:
+    def __init__(self, model):
+        self._model = model
+
+    def route(self, task):
+        return "standard"
+
+    def model(self, tier):
+        return self._model
+
+
+@pytest.fixture
+def batch_env(monkeypatch):
+    chars = [{'mal_id': i, 'name': f"Char {i}", 'about': "A brave hero."} for i in range(1, 5)]
+    store = _Store()
+    monkeypatch.setattr(profile_batch, "fetch_top_characters", lambda top_n: chars[:top_n])
+    monkeypatch.setattr(profile_batch, "get_profile_store", lambda: store)
+    monkeypatch.setattr(profile_batch, "get_scheduler", lambda: GeminiScheduler(rpm=10_000, tpm=10_000_000))
+
+    def _run(replies, budget=100_000):
+        monkeypatch.setattr(profile_batch, "get_router", lambda: _Router(_Model(replies)))
+        return profile_batch.run(4, 2, budget)
+
+    return store, _run
+
+
+def test_malformed_json_still_counts_tokens(batch_env, capsys):
+    store, run = batch_env
+    written = run(["not json", '{"3": "Profile 3", "4": "Profile 4"}'])
+    assert written == 2
+    assert set(store.profiles) == {3, 4}
+    assert "2000 tokens spent" in capsys.readouterr().out
+
+
+def test_sdk_error_stops_cleanly(batch_env, capsys):
+    store, run = batch_env
+    written = run(['{"1": "Profile 1", "2": "Profile 2"}', RuntimeError("400 invalid argument")])
+    assert written == 2
+    assert "Done: 2 profiles written, 1000 tokens spent" in capsys.readouterr().out
+
+
+def test_quota_errors_raise_once_retries_run_out(monkeypatch):
+    pauses = []
+
+    class _Scheduler:
+        def admit(self, priority, tokens):
+            return None
+
+        def pause(self, seconds):
+            pauses.append(seconds)
+
+    monkeypatch.setattr(profile_batch, "get_scheduler", lambda: _Scheduler())
+    errors = [RuntimeError("429 quota exceeded") for _ in range(len(profile_batch.BACKOFF_TIMES) + 1)]
+    chars = [{'mal_id': 1, 'name': "Char 1", 'about': "A brave hero."}]
+    with pytest.raises(RuntimeError):
+        profile_batch.generate_batch(_Model(errors), chars)
+    assert pauses == list(profile_batch.BACKOFF_TIMES)
@@ -0,0 +1,19 @@
+from prompts import FACT_SHARE, compact_biography
+
+
+def _bio(n_facts, sentence_len):
+    facts = "\n".join(f"Fact number {i}: " + "x" * 70 for i in range(n_facts))
+    sentences = " ".join(f"Sentence {i} is about the hero " + "y" * sentence_len + "." for i in range(6))
+    return facts + "\n\n" + sentences
+
+
+def test_facts_leave_room_for_a_real_sentence():
+    out = compact_biography(_bio(6, 150), "Hero", max_chars=400)
+    facts, body = out.split("\n\n")
+    assert len(facts) <= 400 * FACT_SHARE
+    assert body.startswith("Sentence 0") and body.endswith(".")
+    assert len(out) <= 400
+
+
+def test_short_text_is_only_cleaned():
+    assert compact_biography("Age: 17\n\nA loyal ninja.  (Source: Wiki)") == "Age: 17\n\nA loyal ninja."
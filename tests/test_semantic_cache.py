@@ -0,0 +1,41 @@
+import time
+
+from semantic_cache import SemanticCache
+
+CONTEXT = (20, "Happy", "Any", "Anime")
+
+
+def _store(cache, interests, title):
+    age, mood, style, content_type = CONTEXT
+    cache.store(age, interests, mood, style, content_type, [{"title": title}])
+
+
+def _lookup(cache, interests):
+    age, mood, style, content_type = CONTEXT
+    result = cache.lookup(age, interests, mood, style, content_type)
+    return result[0]["title"] if result else None
+
+
+def test_entries_per_context_are_capped_lru(tmp_path):
+    cache = SemanticCache(db_file=str(tmp_path / "sc.sqlite3"), max_entries=2)
+    _store(cache, "cats cyberpunk", "A")
+    _store(cache, "space pirates", "B")
+    assert _lookup(cache, "cats cyberpunk") == "A"  # A thành dùng gần nhất
+    _store(cache, "samurai swords", "C")
+    assert _lookup(cache, "space pirates") is None
+    assert _lookup(cache, "cats cyberpunk") == "A"
+    assert cache._n_docs == 2
+    assert "pirat" not in cache._df
+    reloaded = SemanticCache(db_file=str(tmp_path / "sc.sqlite3"), max_entries=2)
+    assert reloaded._n_docs == 2
+
+
+def test_expired_entries_are_dropped_on_store(tmp_path, monkeypatch):
+    cache = SemanticCache(db_file=str(tmp_path / "sc.sqlite3"), max_age=60)
+    _store(cache, "cats cyberpunk", "A")
+    later = time.time() + 120
+    monkeypatch.setattr("semantic_cache.time.time", lambda: later)
+    _store(cache, "space pirates", "B")
+    assert cache._n_docs == 1
+    assert "cat" not in cache._df
+    assert _lookup(cache, "space pirates") == "B"
@@ -0,0 +1,94 @@
+import threading
+import time
+from io import BytesIO
+from PIL import Image, ImageOps
+
+from storage import connect
+
+# --- VISION: DOWNSCALE + PERCEPTUAL HASH ---
+# Ảnh upload được thu nhỏ trước khi gửi Gemini, và được dHash để ảnh gần
+# giống (re-encode, resize, crop nhẹ) dùng lại kết quả nhận diện cũ.
+
+MODEL_MAX_SIDE = 768  # Gemini chia ảnh thành tile 768px, gửi lớn hơn chỉ tốn băng thông
+JPEG_QUALITY = 85
+MAX_DISTANCE = 8  # Hamming distance tối đa (trên 64 bit) để coi là cùng một ảnh
+DB_FILE = "vision_index.sqlite3"
+
+
+def load_image(image_bytes):
+    img = Image.open(BytesIO(image_bytes))
+    img = ImageOps.exif_transpose(img)
+    return img.convert("RGB")
+
+
+def downscale_for_model(img, max_side=MODEL_MAX_SIDE):
+    """Thu nhỏ về cạnh dài max_side và encode JPEG; trả về bytes"""
+    img = img.copy()
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=JPEG_QUALITY)
+    return buf.getvalue()
+
+
+def dhash(img, size=8):
+    """Difference hash 64 bit: so sánh độ sáng các pixel kề nhau trên ảnh 9x8 grayscale"""
+    small = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class VisionHashIndex:
+    """dHash → tên nhân vật, lưu SQLite; lookup quét tuyến tính trong RAM (vài nghìn ảnh vẫn < 1ms)"""
+
+    def __init__(self, db_file=DB_FILE, max_distance=MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._conn = connect(db_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS vision_hashes (
+                hash TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )""")
+        self._entries = [(int(h, 16), name) for h, name in self._conn.execute("SELECT hash, name FROM vision_hashes")]
+
+    def lookup(self, image_hash):
+        """Tên của ảnh gần nhất trong ngưỡng, hoặc None"""
+        best = None
+        with self._lock:
+            for h, name in self._entries:
+                d = hamming(h, image_hash)
+                if d <= self.max_distance and (best is None or d < best[0]):
+                    best = (d, name)
+        return best[1] if best else None
+
+    def add(self, image_hash, name):
+        with self._lock:
+            self._entries = [e for e in self._entries if e[0] != image_hash]
+            self._entries.append((image_hash, name))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vision_hashes (hash, name, created_at) VALUES (?, ?, ?)",
+                (f"{image_hash:016x}", name, time.time()))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_vision_index():
+    """Process-wide VisionHashIndex"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VisionHashIndex()
+        return _index
@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+
+import streamlit as st
+
+from assets import get_asset_manifest
+from character_index import get_character_index
+from jikan_services import get_genre_map, get_manga_pool
+from model_router import get_router
+
+log = logging.getLogger(__name__)
+
+# --- SERVER WARMUP ---
+# Chạy một lần mỗi process, trên thread nền, để chi phí khởi động lạnh
+# (genre map, model Gemini, ảnh nền, pool manga) không đổ lên user đầu tiên.
+#   python warmup.py  → chạy đồng bộ trong bước deploy để làm nóng cache trên đĩa
+
+STEPS = [
+    ("background assets", get_asset_manifest),
+    ("genre map: anime", lambda: get_genre_map("anime")),
+    ("genre map: manga", lambda: get_genre_map("manga")),
+    ("character index", get_character_index),
+    ("random manga pool", get_manga_pool),
+    ("gemini models", lambda: get_router().warm()),
+]
+
+
+class WarmupStatus:
+    def __init__(self):
+        self.steps = {name: {'state': 'pending', 'seconds': None, 'error': None} for name, _ in STEPS}
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def ready(self):
+        return self.finished_at is not None
+
+    @property
+    def failed(self):
+        return [name for name, s in self.steps.items() if s['state'] == 'failed']
+
+    def report(self):
+        lines = [f"[warmup] {name}: {s['state']}"
+                 + (f" in {s['seconds']:.2f}s" if s['seconds'] is not None else "")
+                 + (f" ({s['error']})" if s['error'] else "")
+                 for name, s in self.steps.items()]
+        if self.ready:
+            lines.append(f"[warmup] ready in {self.finished_at - self.started_at:.2f}s")
+        return "\n".join(lines)
+
+
+def run_warmup(status):
+    for name, step in STEPS:
+        status.steps[name]['state'] = 'running'
+        started = time.monotonic()
+        try:
+            result = step()
+            if result is None or result == {}:
+                # Jikan lỗi thì get_genre_map trả {} (không cache) chứ không raise
+                status.steps[name].update(state='failed', error="empty result")
+            else:
+                status.steps[name]['state'] = 'done'
+        except Exception as e:
+            status.steps[name].update(state='failed', error=str(e)[:200])
+        status.steps[name]['seconds'] = time.monotonic() - started
+    status.finished_at = time.time()
+    if status.failed:
+        log.warning("warmup finished with failures:\n%s", status.report())
+    else:
+        log.debug("%s", status.report())
+    return status
+
+
+@st.cache_resource(show_spinner=False)
+def start_warmup():
+    """Khởi động warmup một lần cho cả process; trả về WarmupStatus để theo dõi"""
+    status = WarmupStatus()
+    threading.Thread(target=run_warmup, args=(status,), name="itook-warmup", daemon=True).start()
+    return status
+
+
+if __name__ == "__main__":
+    print(run_warmup(WarmupStatus()).report())
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+# --- BACKGROUND WORKERS ---
+# Thread pool dùng chung cho cả process, tách theo tên để việc nền của
+# tính năng này không chặn tính năng khác; SingleFlight để gộp request trùng.
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(name="background", max_workers=4):
+    """Process-wide ThreadPoolExecutor, created on first use"""
+    with _lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"itook-{name}")
+        return _executors[name]
+
+
+class SingleFlight:
+    """Gộp các lời gọi trùng key đang chạy đồng thời thành một lời gọi duy nhất.
+
+    Kết quả khác None được giữ lại `ttl` giây để các request đến ngay sau đó
+    cũng dùng chung. Đếm hit / miss / coalesced để theo dõi hiệu quả.
+    """
+
+    def __init__(self, ttl=0, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future đang chạy
+        self._results = OrderedDict()  # key -> (expires_at, result)
+        self.stats = {"hit": 0, "miss": 0, "coalesced": 0}
+
+    def claim(self, key):
+        """API mức thấp cho caller tự chạy (vd. streaming): trả về (future, is_leader).
+
+        Leader phải gọi resolve(); follower chờ future.result().
+        """
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self.stats["hit"] += 1
+                future = Future()
+                future.set_result(cached[1])
+                return future, False
+            future = self._calls.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                return future, False
+            future = self._calls[key] = Future()
+            self.stats["miss"] += 1
+            return future, True
+
+    def resolve(self, key, future, result=None, error=None, cancelled=False):
+        """Leader báo kết quả; cancelled=True để follower tự chạy lại"""
+        with self._lock:
+            self._calls.pop(key, None)
+        if cancelled:
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+            self._remember(key, result)
+
+    def do(self, key, func):
+        future, leader = self.claim(key)
+        if not leader:
+            try:
+                return future.result()
+            except CancelledError:
+                # Leader bị ngắt (vd. Streamlit rerun) → tự chạy lại
+                return self.do(key, func)
+
+        try:
+            result = func()
+        except Exception as e:
+            self.resolve(key, future, error=e)
+            raise
+        except BaseException:
+            self.resolve(key, future, cancelled=True)
+            raise
+        self.resolve(key, future, result)
+        return result
+
+    def _remember(self, key, result):
+        if not self.ttl or result is None:
+            return
+        with self._lock:
+            self._results[key] = (time.monotonic() + self.ttl, result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, in_flight=len(self._calls))